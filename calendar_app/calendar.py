@@ -1,16 +1,83 @@
+import hashlib
+import os
+import threading
 import webcolors
 
-from datetime import datetime, timedelta, timezone, tzinfo
+from datetime import datetime, timedelta
 from sqlalchemy.exc import IntegrityError
 
+from .config import max_batch_size, users_like_limit, schema_provisioned, pool_size, max_page_size, changes_retention, \
+    pool_max_overflow, notifications_backend, notifications_socket_dir, max_batch_operations, max_free_busy_users, \
+    default_meeting_slots
 from .database_manager import DatabaseManager
-from .var_utils import get_password_hash, set_utc
+from .date_parser import parse_datetime, parse_datetimes
+from .intervals import merge_intervals, clip_intervals, off_hours, find_free_slots
+from .notifications import NotificationHub, UnixSocketBackend
+from .recurrence import frequencies, occurrences
+from .var_utils import get_password_hash, set_utc, encode_cursor, decode_cursor, get_timezone, epoch_seconds, \
+    utc_today
+
+
+class _RenderedStream:
+    # streamed rows rendered as they are sent; key of the last sent row is kept, so stream interrupted by database
+    # error can be continued from it as from next page
+    _end = object()
+
+    def __init__(self, rows, render):
+        self._rows = iter(rows)
+        self._render = render
+        self._last = None
+        # first batch is read right away, so failing query is reported as error before response starts
+        self._first = next(self._rows, self._end)
+
+    def __iter__(self):
+        row, self._first = self._first, self._end
+
+        while row is not self._end:
+            key = row['start_time'], row['event_id']
+            yield self._render(row)
+            self._last = key
+            row = next(self._rows, self._end)
+
+    @property
+    def next_cursor(self):
+        return encode_cursor(*self._last) if self._last is not None else None
 
 
 class Calendar:
-    def __init__(self):
-        self._db = DatabaseManager(True)
+    def __init__(self, lazy=False):
+        self._database = None
+        self._database_lock = threading.Lock()
+        self._pool_size = pool_size
+        self._max_overflow = pool_max_overflow
         self._success = {'success': True}
+        self._notifications = NotificationHub(UnixSocketBackend(notifications_socket_dir)
+                                              if notifications_backend == 'unix' else None)
+
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self.reset_after_fork)
+
+        if not lazy:
+            self.init_db()
+
+    def init_db(self):
+        with self._database_lock:
+            if self._database is None:
+                self._database = DatabaseManager(True, schema_provisioned, self._pool_size, self._max_overflow)
+
+        return self._database
+
+    def reset_after_fork(self, pool_size=None, max_overflow=None):
+        self._database_lock = threading.Lock()
+        self._pool_size = pool_size if pool_size is not None else self._pool_size
+        self._max_overflow = max_overflow if max_overflow is not None else self._max_overflow
+
+        if self._database is not None:
+            self._database.reset_engine(self._pool_size, self._max_overflow)
+
+    @property
+    def _db(self):
+        return self._database if self._database is not None else self.init_db()
 
     def _can_read_calendar(self, user_id, calendar_id):
         return self._db.get_user_calendar_privilege(user_id, calendar_id) > 0
@@ -21,12 +88,44 @@ class Calendar:
     def _calendar_owner(self, user_id, calendar_id):
         return self._db.get_user_calendar_privilege(user_id, calendar_id) == 3
 
+    def begin_request(self):
+        self._db.begin_unit_of_work()
+
+    def commit_request(self):
+        # before response is sent, so failed commit is reported instead of success of uncommitted changes
+        try:
+            self._db.commit_unit_of_work()
+        except Exception:
+            return self.error_dict(2, "Database error. Contact administrator.")
+
+    def end_request(self):
+        # anything not committed by commit_request is rolled back
+        self._db.end_unit_of_work(failed=True)
+
+    def subscribe_notifications(self, user_id):
+        return self._notifications.subscribe(user_id)
+
+    def _notify(self, user_ids, event, data):
+        # sent only when changes are committed, so notified client reads them already
+        self._db.after_commit(lambda: self._notifications.publish(user_ids, event, data))
+
     def error_dict(self, error_code, error_desc):
         return {'success': False, 'error': error_code, 'message': error_desc}
 
     def success_dict(self, key, value):
         return {'success': True, key: value}
 
+    def _not_modified_dict(self, etag):
+        return {'success': True, 'not_modified': True, 'etag': etag}
+
+    def _version_tag(self, kind, owner_id):
+        return '{}-{}-{}'.format(kind, owner_id, self._db.get_version(kind, owner_id))
+
+    @staticmethod
+    def _query_hash(*params):
+        # the same version of a list looks different for other window, page, fields or user timezone
+        return hashlib.sha1(repr(params).encode()).hexdigest()[:16]
+
     def _is_invited(self, user_id, event_id):
         try:
             self._db.get_invite_for_user_at_event(user_id, event_id)
@@ -34,35 +133,32 @@ class Calendar:
         except ValueError:
             return False
 
-    def _parse_date_to_utc(self, start_time, end_time, timezone_delta):
+    def _parse_date_to_utc(self, start_time, end_time, timezone_delta, parse=parse_datetime):
         if timezone_delta is None:
-            s = datetime.strptime(start_time, "%Y-%m-%d %H:%M:%S %z")
-            e = datetime.strptime(end_time, "%Y-%m-%d %H:%M:%S %z")
+            s = parse(start_time, True)
+            e = parse(end_time, True)
 
-            if s.tzinfo.utcoffset() != s.tzinfo.utcoffset():
+            if s.utcoffset() != e.utcoffset():
                 raise ValueError("Start time and end time must have same timezone.")
 
-            timezone_delta = int(s.tzinfo.utcoffset() / 60)
+            timezone_delta = int(s.tzinfo.utcoffset(None).seconds / 3600) + s.tzinfo.utcoffset(None).days * 24
         else:
-            s = datetime.strptime(start_time, "%Y-%m-%d %H:%M:%S").replace(
-                tzinfo=timezone(timedelta(hours=timezone_delta)))
-            e = datetime.strptime(end_time, "%Y-%m-%d %H:%M:%S").replace(
-                tzinfo=timezone(timedelta(hours=timezone_delta)))
+            s = parse(start_time).replace(tzinfo=get_timezone(timezone_delta))
+            e = parse(end_time).replace(tzinfo=get_timezone(timezone_delta))
 
         if timezone_delta == 0:
             return s, e, timezone_delta
         else:
             return self._convert_date_to_tz(s, e, 0) + (timezone_delta,)
 
-    def _parse_all_day_event(self, start_time, timezone_delta):
+    def _parse_all_day_event(self, start_time, timezone_delta, parse=parse_datetime):
         if timezone_delta is None:
-            s = datetime.strptime(start_time, "%Y-%m-%d %H:%M:%S %z").replace(hour=0, minute=0, second=0)
+            s = parse(start_time, True).replace(hour=0, minute=0, second=0)
             e = s + timedelta(days=1)
 
             timezone_delta = int(s.tzinfo.utcoffset(None).seconds / 3600) + s.tzinfo.utcoffset(None).days * 24
         else:
-            s = datetime.strptime(start_time, "%Y-%m-%d %H:%M:%S").replace(hour=0, minute=0, second=0, tzinfo=timezone(
-                timedelta(hours=timezone_delta)))
+            s = parse(start_time).replace(hour=0, minute=0, second=0, tzinfo=get_timezone(timezone_delta))
             e = s + timedelta(days=1)
 
         if timezone_delta == 0:
@@ -70,13 +166,39 @@ class Calendar:
         else:
             return self._convert_date_to_tz(s, e, 0) + (timezone_delta,)
 
+    @staticmethod
+    def _batch_date_parser(events):
+        # dates of bulk import are parsed in one pass, repeated ones once; values not parsed there go through
+        # parse_datetime again, so each item is rejected just as single event would be
+        values = {False: set(), True: set()}
+
+        for event in events:
+            if isinstance(event, dict):
+                values[event.get('event_timezone', None) is None].update(
+                    value for value in (event.get('start_time'), event.get('end_time')) if type(value) is str)
+
+        parsed = {}
+
+        for with_offset, strings in values.items():
+            strings = list(strings)
+            dates = parse_datetimes(strings, with_offset)
+            parsed.update(((with_offset, value), date) for value, date in zip(strings, dates) if date is not None)
+
+        def parse(value, with_offset=False):
+            try:
+                return parsed[with_offset, value]
+            except (KeyError, TypeError):
+                return parse_datetime(value, with_offset)
+
+        return parse
+
     def _convert_all_day_event_date_to_tz(self, start_time, original_timezone, user_timezone):
         if start_time.tzinfo is None:
             set_utc(start_time)
 
         time_difference = 0
 
-        start_time_as_event_timezone = start_time.astimezone(timezone(timedelta(hours=original_timezone)))
+        start_time_as_event_timezone = start_time.astimezone(get_timezone(original_timezone))
 
         if not (start_time_as_event_timezone.hour == 0 and start_time_as_event_timezone.minute == 0 and
                         start_time_as_event_timezone.second == 0):
@@ -94,9 +216,8 @@ class Calendar:
             else:
                 start_time_as_event_timezone -= timedelta(days=1)
 
-        return start_time_as_event_timezone.replace(tzinfo=timezone(timedelta(hours=user_timezone))), \
-               (start_time_as_event_timezone + timedelta(days=1)).replace(
-                   tzinfo=timezone(timedelta(hours=user_timezone)))
+        return start_time_as_event_timezone.replace(tzinfo=get_timezone(user_timezone)), \
+               (start_time_as_event_timezone + timedelta(days=1)).replace(tzinfo=get_timezone(user_timezone))
 
     def _convert_date_to_tz(self, start_time, end_time, timezone_delta):
         if start_time.tzinfo is None:
@@ -105,8 +226,89 @@ class Calendar:
         if end_time.tzinfo is None:
             set_utc(end_time)
 
-        return start_time.astimezone(timezone(timedelta(hours=timezone_delta))), \
-               end_time.astimezone(timezone(timedelta(hours=timezone_delta)))
+        return start_time.astimezone(get_timezone(timezone_delta)), \
+               end_time.astimezone(get_timezone(timezone_delta))
+
+    def _parse_window_bound(self, bound, user_timezone):
+        if bound is None:
+            return None
+
+        try:
+            bound = parse_datetime(bound, True)
+        except ValueError:
+            bound = parse_datetime(bound).replace(tzinfo=get_timezone(user_timezone))
+
+        return bound.astimezone(get_timezone(0))
+
+    def _parse_page(self, limit, cursor):
+        if limit is not None and not 0 < limit <= max_page_size:
+            raise ValueError("Page size must be from 1 up to {}.".format(max_page_size))
+
+        return limit, decode_cursor(cursor) if cursor is not None else None
+
+    def _parse_fields(self, fields):
+        if not fields:
+            return None
+
+        return tuple(field.strip() for field in fields.split(','))
+
+    def _page_result(self, key, rows, limit, user_timezone, stream=False, fields=None, compact=False):
+        if stream:
+            result = self.success_dict(key, _RenderedStream(
+                rows, lambda row: self._render_event(row, user_timezone, fields, compact)))
+            result['next_cursor'] = None
+
+            return result
+
+        result = self.success_dict(key, rows)
+
+        if limit is not None:
+            result['next_cursor'] = None
+
+            if len(rows) > limit:
+                del rows[limit:]
+                result['next_cursor'] = encode_cursor(rows[-1]['start_time'], rows[-1]['event_id'])
+
+        result[key] = self._render_events(rows, user_timezone, fields, compact)
+
+        return result
+
+    def _render_event(self, event_dict, user_timezone, fields=None, compact=False):
+        if compact:
+            self._event_as_compact(event_dict, user_timezone)
+        else:
+            self._event_as_user_event_timezone(event_dict, user_timezone)
+
+        if fields is None:
+            return event_dict
+
+        return {field: event_dict[field] for field in fields if field in event_dict}
+
+    def _render_events(self, events, user_timezone, fields=None, compact=False):
+        if compact:
+            for event_dict in events:
+                self._event_as_compact(event_dict, user_timezone)
+        else:
+            self._events_as_user_event_timezone(events, user_timezone)
+
+        if fields is None:
+            return events
+
+        return [{field: event_dict[field] for field in fields if field in event_dict} for event_dict in events]
+
+    def _event_as_compact(self, event_dict, user_timezone):
+        # epoch seconds instead of formatted dates, offsets to render them are in event_timezone and user_timezone
+        if event_dict['all_day_event']:
+            start_time, end_time = self._convert_all_day_event_date_to_tz(event_dict['start_time'],
+                                                                          event_dict['event_timezone'], user_timezone)
+        else:
+            start_time, end_time = event_dict['start_time'], event_dict['end_time']
+
+        event_dict['start_time'] = epoch_seconds(start_time)
+        event_dict['end_time'] = epoch_seconds(end_time)
+        event_dict['user_timezone'] = user_timezone
+
+        return event_dict
 
     def _event_as_user_event_timezone(self, event_dict, user_timezone):
         if event_dict['all_day_event']:
@@ -123,6 +325,24 @@ class Calendar:
 
         return event_dict
 
+    def _events_as_user_event_timezone(self, events, user_timezone):
+        user_tzinfo = get_timezone(user_timezone)
+
+        for event_dict in events:
+            if event_dict['all_day_event']:
+                self._event_as_user_event_timezone(event_dict, user_timezone)
+            else:
+                start_time, end_time = event_dict['start_time'], event_dict['end_time']
+                event_tzinfo = get_timezone(event_dict['event_timezone'])
+
+                event_dict['user_start_time'] = start_time.astimezone(user_tzinfo)
+                event_dict['user_end_time'] = end_time.astimezone(user_tzinfo)
+                event_dict['start_time'] = start_time.astimezone(event_tzinfo)
+                event_dict['end_time'] = end_time.astimezone(event_tzinfo)
+                event_dict['user_timezone'] = user_timezone
+
+        return events
+
     def authorize_user(self, username, password):
         username = username.strip()
         password = password.strip()
@@ -176,8 +396,64 @@ class Calendar:
         except Exception:
             return self.error_dict(2, "Database error. Contact administrator.")
 
+    def _validate_event(self, event_name, event_description, start_time, end_time, event_timezone, all_day_event,
+                        parse=parse_datetime):
+        event_name = event_name.strip()
+        event_description = event_description.strip()
+
+        if not 4 <= len(event_name) <= 30:
+            return self.error_dict(1, "Event name must be at least 4 and up to 30 characters long."), None
+
+        if len(event_description) > 200:
+            return self.error_dict(1, "Event description too long, it should contain up to 200 characters."), None
+
+        try:
+            if all_day_event:
+                start_time, end_time, event_timezone = self._parse_all_day_event(start_time, event_timezone, parse)
+            else:
+                start_time, end_time, event_timezone = self._parse_date_to_utc(start_time, end_time, event_timezone,
+                                                                               parse)
+
+                if start_time > end_time:
+                    return self.error_dict(1, "Event cannot end before it started."), None
+        except ValueError:
+            return self.error_dict(4, "Request malformed. Bad date format."), None
+
+        return None, (event_name, event_description, start_time, end_time, event_timezone, all_day_event)
+
+    def _validate_recurrence(self, recurrence, start_time, event_timezone):
+        try:
+            frequency, interval = recurrence['frequency'], recurrence.get('interval', 1)
+            count, until = recurrence.get('count', None), recurrence.get('until', None)
+        except (KeyError, TypeError, AttributeError):
+            return self.error_dict(4, "Request malformed, recurrence frequency must be provided."), None
+
+        if frequency not in frequencies:
+            return self.error_dict(1, "Recurrence frequency should be one of: {}.".format(', '.join(frequencies))), \
+                None
+
+        if type(interval) is not int or count is not None and type(count) is not int:
+            return self.error_dict(4, "Request malformed, recurrence interval and count must be integers."), None
+
+        if interval < 1 or count is not None and count < 1:
+            return self.error_dict(1, "Recurrence interval and count must be positive."), None
+
+        if count is not None and until is not None:
+            return self.error_dict(1, "Recurrence can end either after count of occurrences or at given time."), None
+
+        if until is not None:
+            try:
+                until = self._parse_window_bound(until, event_timezone)
+            except (ValueError, TypeError):
+                return self.error_dict(4, "Request malformed. Bad date format."), None
+
+            if until < start_time:
+                return self.error_dict(1, "Recurrence cannot end before event started."), None
+
+        return None, (frequency, interval, count, until)
+
     def add_event(self, user_id, calendar_id, event_name, event_description, start_time, end_time, event_timezone,
-                  all_day_event):
+                  all_day_event, recurrence=None):
         try:
             if not self._can_edit_calendar(user_id, calendar_id):
                 return self.error_dict(3, "You have no edit permissions for given calendar.")
@@ -187,36 +463,73 @@ class Calendar:
         if None in [calendar_id, event_name, event_description, start_time, end_time, all_day_event]:
             return self.error_dict(4, "Request malformed, all values must be provided")
 
-        event_name = event_name.strip()
-        event_description = event_description.strip()
+        error, event = self._validate_event(event_name, event_description, start_time, end_time, event_timezone,
+                                            all_day_event)
 
-        if not 4 <= len(event_name) <= 30:
-            return self.error_dict(1, "Event name must be at least 4 and up to 30 characters long.")
+        if error is not None:
+            return error
 
-        if len(event_description) > 200:
-            return self.error_dict(1, "Event description too long, it should contain up to 200 characters.")
+        if recurrence is not None:
+            error, recurrence = self._validate_recurrence(recurrence, event[2], event[4])
+
+            if error is not None:
+                return error
 
         try:
-            if all_day_event:
-                start_time, end_time, event_timezone = self._parse_all_day_event(start_time, event_timezone)
-            else:
-                start_time, end_time, event_timezone = self._parse_date_to_utc(start_time, end_time, event_timezone)
+            with self._db.unit_of_work():
+                event_id = self._db.add_event(calendar_id, *event)
 
-                if start_time > end_time:
-                    return self.error_dict(1, "Event cannot end before it started.")
-        except ValueError:
-            return self.error_dict(4, "Request malformed. Bad date format.")
+                self._db.add_invite(event_id, user_id, True)
+
+                if recurrence is not None:
+                    self._db.set_recurrence(event_id, *recurrence)
 
+            return self.success_dict('event_id', event_id)
+        except Exception:
+            return self.error_dict(2, "Database error. Contact administrator.")
+
+    def add_events(self, user_id, calendar_id, events):
         try:
-            event_id = self._db.add_event(calendar_id, event_name, event_description, start_time, end_time,
-                                          event_timezone, all_day_event)
+            if not self._can_edit_calendar(user_id, calendar_id):
+                return self.error_dict(3, "You have no edit permissions for given calendar.")
+        except ValueError:
+            return self.error_dict(1, "Calendar does not exist.")
 
-            self._db.add_invite(event_id, user_id, True)
+        if not 0 < len(events) <= max_batch_size:
+            return self.error_dict(4, "Request malformed, batch must contain from 1 up to {} items.".format(
+                max_batch_size))
 
-            return self.success_dict('event_id', event_id)
+        results, valid_events = [], []
+        parse = self._batch_date_parser(events)
+
+        for event in events:
+            try:
+                if None in [event['event_name'], event['event_description'], event['start_time'],
+                            event['end_time'], event['all_day_event']]:
+                    raise KeyError()
+
+                error, event = self._validate_event(event['event_name'], event['event_description'],
+                                                    event['start_time'], event['end_time'],
+                                                    event.get('event_timezone', None), event['all_day_event'], parse)
+            except (KeyError, TypeError, AttributeError):
+                error = self.error_dict(4, "Request malformed, all values must be provided")
+
+            if error is None:
+                valid_events.append(event)
+
+            results.append(error)
+
+        if not valid_events:
+            return self.success_dict('events', results)
+
+        try:
+            event_ids = iter(self._db.add_events(calendar_id, user_id, valid_events))
         except Exception:
             return self.error_dict(2, "Database error. Contact administrator.")
 
+        return self.success_dict('events', [self.success_dict('event_id', next(event_ids)) if result is None else result
+                                            for result in results])
+
     def share_calendar(self, user_id, calendar_id, share_with_id, write_permission):
         try:
             if not self._calendar_owner(user_id, calendar_id):
@@ -225,6 +538,8 @@ class Calendar:
             return self.error_dict(1, "Calendar does not exist.")
 
         try:
+            self._db.invalidate_calendar_privileges(calendar_id, share_with_id)
+
             return self.success_dict('share_id', self._db.add_share(calendar_id, share_with_id, write_permission))
         except IntegrityError:
             return self.error_dict(1, "Calendar already shared with this user.")
@@ -239,12 +554,48 @@ class Calendar:
             return self.error_dict(1, "Event does not exist.")
 
         try:
-            return self.success_dict('invite_id', self._db.add_invite(event_id, invited_id, is_owner))
+            invite_id = self._db.add_invite(event_id, invited_id, is_owner)
+            self._notify([invited_id], 'invite', {'invite_id': invite_id, 'event_id': event_id})
+
+            return self.success_dict('invite_id', invite_id)
         except IntegrityError:
             return self.error_dict(1, "User not existing or already invited to this event.")
         except Exception:
             return self.error_dict(2, "Database error. Contact administrator.")
 
+    def invite_users(self, user_id, event_id, invited_ids):
+        try:
+            if not self._can_edit_calendar(user_id, self._db.get_calendar_id_for_event(event_id)):
+                return self.error_dict(3, "Calendar edit permission is required to invite to its events.")
+        except ValueError:
+            return self.error_dict(1, "Event does not exist.")
+
+        if not 0 < len(invited_ids) <= max_batch_size:
+            return self.error_dict(4, "Request malformed, batch must contain from 1 up to {} items.".format(
+                max_batch_size))
+
+        try:
+            new_invites, already_invited = self._db.add_invites(event_id, list(set(invited_ids)))
+        except Exception:
+            return self.error_dict(2, "Database error. Contact administrator.")
+
+        results = []
+
+        for invited_id in invited_ids:
+            if invited_id in new_invites:
+                already_invited[invited_id] = new_invites.pop(invited_id)
+                result = self.success_dict('invite_id', already_invited[invited_id])
+                self._notify([invited_id], 'invite', {'invite_id': already_invited[invited_id], 'event_id': event_id})
+            elif invited_id in already_invited:
+                result = self.error_dict(1, "User already invited to this event.")
+            else:
+                result = self.error_dict(1, "User not existing or already invited to this event.")
+
+            result['user_id'] = invited_id
+            results.append(result)
+
+        return self.success_dict('invites', results)
+
     def edit_calendar(self, user_id, calendar_id, calendar_name, calendar_color):
         try:
             if not self._can_edit_calendar(user_id, calendar_id):
@@ -271,40 +622,257 @@ class Calendar:
         if None in [event_name, event_description, start_time, end_time, all_day_event]:
             return self.error_dict(4, "Request malformed, all values must be provided")
 
-        event_name = event_name.strip()
-        event_description = event_description.strip()
+        error, event = self._validate_event(event_name, event_description, start_time, end_time, event_timezone,
+                                            all_day_event)
 
-        if not 4 <= len(event_name) <= 30:
-            return self.error_dict(1, "Event name must be at least 4 and up to 30 characters long.")
+        if error is not None:
+            return error
 
-        if len(event_description) > 200:
-            return self.error_dict(1, "Event description too long, it should contain up to 200 characters.")
+        try:
+            result = self.success_dict('event_id', self._db.update_event(event_id, *event))
+            self._notify([guest_id for guest_id in self._db.get_event_user_ids(event_id) if guest_id != user_id],
+                         'event_changed', {'event_id': event_id})
 
+            return result
+        except Exception:
+            return self.error_dict(2, "Database error. Contact administrator.")
+
+    def set_event_recurrence(self, user_id, event_id, recurrence):
         try:
-            if all_day_event:
-                start_time, end_time, event_timezone = self._parse_all_day_event(start_time, event_timezone)
-            else:
-                start_time, end_time, event_timezone = self._parse_date_to_utc(start_time, end_time, event_timezone)
+            if not self._can_edit_calendar(user_id, self._db.get_calendar_id_for_event(event_id)):
+                return self.error_dict(3, "Calendar edit permission is required to edit its events.")
 
-                if start_time > end_time:
-                    return self.error_dict(1, "Event cannot end before it started.")
+            event = self._db.get_event(event_id)
+        except ValueError:
+            return self.error_dict(1, "Event does not exist.")
+
+        error, recurrence = self._validate_recurrence(recurrence, event['start_time'], event['event_timezone'])
+
+        if error is not None:
+            return error
+
+        return self._change_recurrence(user_id, event_id, self._db.set_recurrence, *recurrence)
+
+    def delete_event_recurrence(self, user_id, event_id):
+        try:
+            if not self._can_edit_calendar(user_id, self._db.get_calendar_id_for_event(event_id)):
+                return self.error_dict(3, "Calendar edit permission is required to edit its events.")
+        except ValueError:
+            return self.error_dict(1, "Event does not exist.")
+
+        return self._change_recurrence(user_id, event_id, self._db.delete_recurrence)
+
+    def add_recurrence_exception(self, user_id, event_id, occurrence_start):
+        try:
+            if not self._can_edit_calendar(user_id, self._db.get_calendar_id_for_event(event_id)):
+                return self.error_dict(3, "Calendar edit permission is required to edit its events.")
+
+            event = self._db.get_event(event_id)
+            recurrence = self._db.get_recurrence(event_id)
+        except ValueError:
+            return self.error_dict(1, "Event does not exist.")
+        except Exception:
+            return self.error_dict(2, "Database error. Contact administrator.")
+
+        if recurrence is None:
+            return self.error_dict(1, "Event does not recur.")
+
+        try:
+            occurrence_start = self._parse_window_bound(occurrence_start, event['event_timezone'])
+        except (ValueError, TypeError):
+            return self.error_dict(4, "Request malformed. Bad date format.")
+
+        # only start of an actual occurrence can be skipped
+        next_occurrence = next(occurrences(event['start_time'], event['end_time'], event['event_timezone'],
+                                           recurrence['frequency'], recurrence['interval'], recurrence['count'],
+                                           recurrence['until'], not_before=occurrence_start,
+                                           to_time=occurrence_start + timedelta(seconds=1)), None)
+
+        if next_occurrence is None:
+            return self.error_dict(1, "No occurrence of the event starts at given time.")
+
+        return self._change_recurrence(user_id, event_id, self._db.add_recurrence_exception, occurrence_start)
+
+    def _change_recurrence(self, user_id, event_id, change, *args):
+        try:
+            change(event_id, *args)
+            self._notify([guest_id for guest_id in self._db.get_event_user_ids(event_id) if guest_id != user_id],
+                         'event_changed', {'event_id': event_id})
+
+            return self.success_dict('event_id', event_id)
+        except Exception:
+            return self.error_dict(2, "Database error. Contact administrator.")
+
+    def get_calendars(self, user_id, if_none_match=()):
+        try:
+            etag = self._version_tag('calendars', user_id)
+
+            if etag in if_none_match:
+                return self._not_modified_dict(etag)
+
+            result = self.success_dict('calendars', self._db.get_user_calendars(user_id))
+            result['etag'] = etag
+
+            return result
+        except Exception:
+            return self.error_dict(2, "Database error. Contact administrator.")
+
+    def get_events(self, user_id, user_timezone, calendar_id, from_time=None, to_time=None, limit=None, cursor=None,
+                   stream=False, fields=None, compact=False, if_none_match=()):
+        try:
+            if not self._can_read_calendar(user_id, calendar_id):
+                return self.error_dict(3, "Calendar read permission required to perform this action.")
+        except ValueError:
+            return self.error_dict(1, "Calendar does not exist.")
+
+        try:
+            from_time = self._parse_window_bound(from_time, user_timezone)
+            to_time = self._parse_window_bound(to_time, user_timezone)
+            limit, after = self._parse_page(limit, cursor)
+        except ValueError:
+            return self.error_dict(4, "Request malformed. Bad date format, page size or cursor.")
+
+        if from_time is not None and to_time is not None and from_time > to_time:
+            return self.error_dict(1, "Time window cannot end before it started.")
+
+        stream = stream and limit is None
+        fields = self._parse_fields(fields)
+        # occurrences of never-ending series are listed up to horizon counted from today when window has no start
+        horizon_start = utc_today() if from_time is None and to_time is None else None
+
+        try:
+            # version is read before events, so concurrent change can only make the tag outdated, never too new
+            etag = '{}-{}'.format(self._version_tag('calendar', calendar_id), self._query_hash(
+                from_time, to_time, limit, after, stream, fields, bool(compact), user_timezone, horizon_start))
+
+            if etag in if_none_match:
+                return self._not_modified_dict(etag)
+
+            result = self._page_result('events', self._db.get_calendar_events(
+                calendar_id, from_time, to_time, limit, after, stream, horizon_start=horizon_start), limit,
+                user_timezone, stream, fields, compact)
+            result['etag'] = etag
+
+            return result
+        except Exception:
+            return self.error_dict(2, "Database error. Contact administrator.")
+
+    def get_agenda(self, user_id, user_timezone, from_time=None, to_time=None, limit=None, cursor=None, stream=False,
+                   fields=None, compact=False):
+        try:
+            from_time = self._parse_window_bound(from_time, user_timezone)
+            to_time = self._parse_window_bound(to_time, user_timezone)
+            limit, after = self._parse_page(limit, cursor)
+        except ValueError:
+            return self.error_dict(4, "Request malformed. Bad date format, page size or cursor.")
+
+        if from_time is not None and to_time is not None and from_time > to_time:
+            return self.error_dict(1, "Time window cannot end before it started.")
+
+        try:
+            stream = stream and limit is None
+
+            return self._page_result('events', self._db.get_agenda(user_id, from_time, to_time, limit, after, stream),
+                                     limit, user_timezone, stream, self._parse_fields(fields), compact)
+        except Exception:
+            return self.error_dict(2, "Database error. Contact administrator.")
+
+    def get_free_busy(self, user_id, user_timezone, user_ids, from_time, to_time):
+        if not 0 < len(user_ids) <= max_free_busy_users:
+            return self.error_dict(4, "Request malformed, from 1 up to {} users can be checked at once.".format(
+                max_free_busy_users))
+
+        try:
+            from_time = self._parse_window_bound(from_time, user_timezone)
+            to_time = self._parse_window_bound(to_time, user_timezone)
         except ValueError:
             return self.error_dict(4, "Request malformed. Bad date format.")
 
+        if from_time is None or to_time is None:
+            return self.error_dict(4, "Request malformed. Time window must be given.")
+
+        if from_time > to_time:
+            return self.error_dict(1, "Time window cannot end before it started.")
+
         try:
-            return self.success_dict('event_id', self._db.update_event(event_id, event_name, event_description,
-                                                                       start_time, end_time, event_timezone,
-                                                                       all_day_event))
+            busy_times = self._get_busy_intervals(user_ids, from_time, to_time)
         except Exception:
             return self.error_dict(2, "Database error. Contact administrator.")
 
-    def get_calendars(self, user_id):
+        result = self.success_dict('busy', [{'user_id': busy_user_id, 'intervals': intervals}
+                                            for busy_user_id, intervals in busy_times.items()])
+        result['from'], result['to'] = epoch_seconds(from_time), epoch_seconds(to_time)
+
+        return result
+
+    def find_meeting_slots(self, user_id, user_timezone, user_ids, duration, from_time, to_time, work_from=None,
+                           work_to=None, limit=None):
+        if not 0 < len(user_ids) <= max_free_busy_users:
+            return self.error_dict(4, "Request malformed, from 1 up to {} users can be checked at once.".format(
+                max_free_busy_users))
+
         try:
-            return self.success_dict('calendars', self._db.get_user_calendars(user_id))
+            from_time = self._parse_window_bound(from_time, user_timezone)
+            to_time = self._parse_window_bound(to_time, user_timezone)
+        except ValueError:
+            return self.error_dict(4, "Request malformed. Bad date format.")
+
+        if from_time is None or to_time is None or duration is None:
+            return self.error_dict(4, "Request malformed. Time window and duration must be given.")
+
+        if limit is None:
+            limit = default_meeting_slots
+        elif not 0 < limit <= max_page_size:
+            return self.error_dict(4, "Request malformed, from 1 up to {} slots can be returned.".format(
+                max_page_size))
+
+        if (work_from is None) != (work_to is None):
+            return self.error_dict(4, "Request malformed. Both ends of working hours must be given.")
+
+        if from_time > to_time:
+            return self.error_dict(1, "Time window cannot end before it started.")
+
+        if duration <= 0:
+            return self.error_dict(1, "Meeting duration must be positive.")
+
+        if work_from is not None and not 0 <= work_from < work_to <= 24:
+            return self.error_dict(1, "Working hours should be between 0 and 24, starting before they end.")
+
+        window_start, window_end = epoch_seconds(from_time), epoch_seconds(to_time)
+
+        try:
+            timezones = self._db.get_users_timezones(user_ids)
+
+            if len(timezones) < len(set(user_ids)):
+                return self.error_dict(1, "User does not exist.")
+
+            busy_lists = list(self._get_busy_intervals(user_ids, from_time, to_time).values())
         except Exception:
             return self.error_dict(2, "Database error. Contact administrator.")
 
-    def get_events(self, user_id, user_timezone, calendar_id):
+        if work_from is not None:
+            # users in the same timezone share working hours
+            busy_lists.extend(off_hours(window_start, window_end, work_from, work_to, own_timezone)
+                              for own_timezone in set(timezones.values()))
+
+        result = self.success_dict('slots', find_free_slots(busy_lists, window_start, window_end, duration * 60,
+                                                            limit))
+        result['from'], result['to'] = window_start, window_end
+
+        return result
+
+    def _get_busy_intervals(self, user_ids, from_time, to_time):
+        busy_times = {busy_user_id: [] for busy_user_id in user_ids}
+
+        for busy_user_id, start_time, end_time in self._db.get_busy_times(list(busy_times), from_time, to_time):
+            busy_times[busy_user_id].append((epoch_seconds(start_time), epoch_seconds(end_time)))
+
+        window_start, window_end = epoch_seconds(from_time), epoch_seconds(to_time)
+
+        return {busy_user_id: clip_intervals(merge_intervals(intervals), window_start, window_end)
+                for busy_user_id, intervals in busy_times.items()}
+
+    def get_changes(self, user_id, user_timezone, calendar_id, since=None, fields=None, compact=False):
         try:
             if not self._can_read_calendar(user_id, calendar_id):
                 return self.error_dict(3, "Calendar read permission required to perform this action.")
@@ -312,12 +880,57 @@ class Calendar:
             return self.error_dict(1, "Calendar does not exist.")
 
         try:
-            return self.success_dict('events', list(map(lambda e: self._event_as_user_event_timezone(e, user_timezone),
-                                                        self._db.get_calendar_events(calendar_id))))
+            sync_token = self._db.get_version('changes', calendar_id)
+
+            if since is None:
+                since = sync_token
+            elif not 0 <= since <= sync_token:
+                return self.error_dict(4, "Request malformed. Bad sync token.")
+            elif since < self._db.get_version('compacted', calendar_id):
+                return self.error_dict(6, "Sync token expired. Whole calendar must be fetched again.")
+
+            # only last change of each entity matters
+            operations = {}
+
+            for version, entity, entity_id, operation in self._db.get_changes(calendar_id, since):
+                operations[entity, entity_id] = operation
+                sync_token = max(sync_token, version)
+
+            changed_event_ids = [entity_id for (entity, entity_id), operation in operations.items()
+                                 if entity == 'event' and operation != 'delete']
+            events = self._db.get_calendar_events(calendar_id, event_ids=changed_event_ids) \
+                if changed_event_ids else []
+
+            existing_event_ids = {event['event_id'] for event in events}
+            deleted_event_ids = {entity_id for (entity, entity_id), operation in operations.items()
+                                 if entity == 'event' and entity_id not in existing_event_ids}
+
+            result = self.success_dict('events', self._render_events(events, user_timezone,
+                                                                     self._parse_fields(fields), compact))
+            result['deleted_events'] = sorted(deleted_event_ids)
+            result['guests_changed'] = [entity_id for entity, entity_id in operations
+                                        if entity == 'guests' and entity_id not in deleted_event_ids]
+            result['shares_changed'] = any(entity == 'share' for entity, entity_id in operations)
+            result['sync_token'] = sync_token
+
+            return result
+        except Exception:
+            return self.error_dict(2, "Database error. Contact administrator.")
+
+    def compact_changes(self):
+        try:
+            return self.success_dict('removed', self._db.compact_changes(datetime.utcnow() -
+                                                                         timedelta(days=changes_retention)))
+        except Exception:
+            return self.error_dict(2, "Database error. Contact administrator.")
+
+    def upgrade_indexes(self):
+        try:
+            return self.success_dict('changed', self._db.upgrade_indexes())
         except Exception:
             return self.error_dict(2, "Database error. Contact administrator.")
 
-    def get_event(self, user_id, user_timezone, event_id):
+    def get_event(self, user_id, user_timezone, event_id, fields=None, compact=False):
         try:
             if not self._can_read_calendar(user_id, self._db.get_calendar_id_for_event(event_id)):
                 return self.error_dict(3, "Calendar read permission required to perform this action.")
@@ -325,23 +938,52 @@ class Calendar:
             return self.error_dict(1, "Calendar does not exist.")
 
         try:
-            return self.success_dict('event', self._event_as_user_event_timezone(self._db.get_event(event_id),
-                                                                                 user_timezone))
+            event = self._db.get_event(event_id)
+            event['recurrence'] = self._db.get_recurrence(event_id)
+
+            return self.success_dict('event', self._render_event(event, user_timezone, self._parse_fields(fields),
+                                                                 compact))
         except Exception:
             return self.error_dict(2, "Database error. Contact administrator.")
 
-    def get_invites(self, user_id, user_timezone, archive=False):
+    def get_invites(self, user_id, user_timezone, archive=False, limit=None, cursor=None, stream=False, fields=None,
+                    compact=False, if_none_match=()):
         try:
-            return self.success_dict('invites', list(map(lambda e: self._event_as_user_event_timezone(e,
-                                                                                                      user_timezone),
-                                                         self._db.get_invites(user_id, archive))))
+            limit, after = self._parse_page(limit, cursor)
+        except ValueError:
+            return self.error_dict(4, "Request malformed. Bad page size or cursor.")
+
+        try:
+            # invites move to archive as time passes, so tag also holds the moment when it stops being valid
+            version_tag = self._version_tag('invites', user_id)
+            now = datetime.utcnow()
+
+            for etag in if_none_match:
+                tag, _, valid_until = etag.rpartition('-')
+
+                if tag == version_tag and valid_until.isdigit() and \
+                        (valid_until == '0' or int(valid_until) > epoch_seconds(now)):
+                    return self._not_modified_dict(etag)
+
+            next_end_time = self._db.get_next_invite_end_time(user_id, now)
+            etag = '{}-{}'.format(version_tag, epoch_seconds(next_end_time) if next_end_time is not None else 0)
+
+            stream = stream and limit is None
+
+            result = self._page_result('invites', self._db.get_invites(user_id, archive, limit, after, stream), limit,
+                                       user_timezone, stream, self._parse_fields(fields), compact)
+            result['etag'] = etag
+
+            return result
         except Exception as e:
             return self.error_dict(2, "Database error. Contact administrator.")
 
-    def get_invite(self, user_id, user_timezone, invite_id):
+    def get_invite(self, user_id, user_timezone, invite_id, fields=None, compact=False):
         try:
-            return self.success_dict('invite', list(map(lambda e: self._event_as_user_event_timezone(e, user_timezone),
-                                                        self._db.get_invite(user_id, invite_id))))
+            invite = self._db.get_invite(user_id, invite_id)
+
+            return self.success_dict('invite', self._render_event(invite, user_timezone, self._parse_fields(fields),
+                                                                  compact))
         except ValueError:
             return self.error_dict(1, "Invite does not exist.")
         except Exception as e:
@@ -400,11 +1042,15 @@ class Calendar:
             return self.error_dict(2, "Database error. Contact administrator.")
 
     def edit_invite_attendance(self, user_id, invite_id, attendance):
-        if 1 > attendance > 3:
+        if not 1 <= attendance <= 3:
             return self.error_dict(1, "Attendance status unknown or not allowed.")
 
         try:
             if self._db.update_invite_attendance(user_id, invite_id, attendance):
+                event_id = self._db.get_event_id_for_invite(invite_id)
+                self._notify([guest_id for guest_id in self._db.get_event_user_ids(event_id) if guest_id != user_id],
+                             'attendance', {'event_id': event_id, 'user_id': user_id, 'attendance': attendance})
+
                 return self._success
             else:
                 return self.error_dict(4, "Invite does not exist or request malformed.")
@@ -419,12 +1065,16 @@ class Calendar:
 
     def edit_share_permission(self, user_id, share_id, write_permission):
         try:
-            if not self._calendar_owner(user_id, self._db.get_calendar_id_for_share(share_id)):
+            calendar_id = self._db.get_calendar_id_for_share(share_id)
+
+            if not self._calendar_owner(user_id, calendar_id):
                 return self.error_dict(3, "Calendar ownership required to perform this action.")
         except ValueError:
             return self.error_dict(1, "This calendar was not shared with given user.")
 
         try:
+            self._db.invalidate_calendar_privileges(calendar_id)
+
             if self._db.update_share(share_id, write_permission):
                 return self._success
             else:
@@ -434,12 +1084,16 @@ class Calendar:
 
     def delete_share(self, user_id, share_id):
         try:
-            if not self._calendar_owner(user_id, self._db.get_calendar_id_for_share(share_id)):
+            calendar_id = self._db.get_calendar_id_for_share(share_id)
+
+            if not self._calendar_owner(user_id, calendar_id):
                 return self.error_dict(3, "Calendar ownership required to perform this action.")
         except ValueError:
             return self.error_dict(1, "This calendar was not shared with given user.")
 
         try:
+            self._db.invalidate_calendar_privileges(calendar_id)
+
             if self._db.delete_share(share_id):
                 return self._success
             else:
@@ -455,7 +1109,11 @@ class Calendar:
             return self.error_dict(1, "Event does not exist.")
 
         try:
+            guest_ids = [guest_id for guest_id in self._db.get_event_user_ids(event_id) if guest_id != user_id]
+
             if self._db.delete_event(event_id):
+                self._notify(guest_ids, 'event_deleted', {'event_id': event_id})
+
                 return self._success
             else:
                 return self.error_dict(9, "Unknown error")
@@ -470,6 +1128,8 @@ class Calendar:
             return self.error_dict(1, "Calendar does not exist.")
 
         try:
+            self._db.invalidate_calendar_privileges(calendar_id)
+
             if self._db.delete_calendar(calendar_id):
                 return self._success
             else:
@@ -491,11 +1151,59 @@ class Calendar:
         except Exception:
             return self.error_dict(2, "Database error. Contact administrator.")
 
-    def get_users(self, like_string):
+    def get_guests_for_events(self, user_id, event_ids):
+        try:
+            return self.success_dict("guests", self._db.get_guests_for_events(
+                self._db.get_visible_event_ids(user_id, list(set(event_ids)))))
+        except Exception:
+            return self.error_dict(2, "Database error. Contact administrator.")
+
+    def run_batch(self, operations, atomic=False):
+        # operations are callables of single Calendar methods, run on one connection with shared privilege cache;
+        # each one is rolled back alone if it fails, unless whole batch is atomic
+        if not 0 < len(operations) <= max_batch_operations:
+            return self.error_dict(4, "Request malformed, batch must contain from 1 up to {} operations.".format(
+                max_batch_operations))
+
+        results = []
+
+        with self._db.unit_of_work():
+            for index, operation in enumerate(operations):
+                if atomic:
+                    result = self._run_batch_operation(operation)
+                else:
+                    with self._db.savepoint():
+                        result = self._run_batch_operation(operation)
+
+                result.pop('etag', None)
+                results.append(result)
+
+                if atomic and not result['success']:
+                    self._db.fail_unit_of_work()
+
+                    error = self.error_dict(result['error'], "Batch operation {} failed, no changes were saved.".format(
+                        index))
+                    error['results'] = results
+
+                    return error
+
+        return self.success_dict('results', results)
+
+    def _run_batch_operation(self, operation):
+        try:
+            return operation()
+        except (KeyError, TypeError, ValueError):
+            return self.error_dict(4, "Request malformed. Missing data.")
+        except Exception:
+            return self.error_dict(5, "Server error.")
+
+    def get_users(self, like_string, prefix=False, limit=None):
+        limit = users_like_limit if limit is None else min(max(limit, 1), users_like_limit)
+
         try:
-            return self.success_dict("users_like", self._db.get_users_like(like_string))
+            return self.success_dict("users_like", self._db.get_users_like(like_string, limit, prefix))
         except Exception:
             return self.error_dict(2, "Database error. Contact administrator.")
 
 
-calendar_app = Calendar()
+calendar_app = Calendar(lazy=True)
@@ -6,5 +6,52 @@ database_name = "calendar-db"
 
 debug = False
 
+# skips database existence check and table creation on startup
+schema_provisioned = False
+
+pool_size = 5
+pool_max_overflow = 10
+pool_recycle = 3600
+
+# multi-process serving, see gunicorn_config.py; 0 workers means 2 * CPU cores + 1,
+# pool and overflow connections of all workers are capped by max connections, 0 means each worker opens up to
+# pool_size + pool_max_overflow
+workers = 0
+db_max_connections = 0
+# threads of each worker - notification streams keep one thread busy for as long as client is connected; pooled
+# connection is checked out only by requests that use database, on first query
+worker_threads = 32
+
+secret_key = "flaskmfsimplecalendarsecretkey"
+
+max_batch_size = 50000
+# operations in single /batch request
+max_batch_operations = 100
+# users in single free/busy query
+max_free_busy_users = 100
+# meeting slots returned when not limited by request
+default_meeting_slots = 10
+
+# occurrences of recurring events without end are listed up to that many days after window start (or now) when
+# window has no end
+recurrence_horizon = 365
+
+users_like_limit = 20
+max_page_size = 500
+username_index_enabled = False
+username_index_refresh = 5
+
+# calendar privileges cached within one request (unit of work)
+privilege_cache_size = 1024
+
+# 'local' - notifications reach only clients connected to the same process, 'unix' - fan-out between worker
+# processes through Unix sockets in notifications_socket_dir
+notifications_backend = 'local'
+notifications_socket_dir = '/tmp/mf-simple-calendar-notifications'
+notifications_heartbeat = 15
+
+# calendar change log entries older than that (in days) are removed by compact_changes.py
+changes_retention = 30
+
 salt_1 = "ccsimplecalendarmf"
 salt_2 = "mfsimplecalendarcc"
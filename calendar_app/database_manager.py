@@ -1,24 +1,83 @@
 from sqlalchemy import create_engine, Table, Column, Integer, DateTime, String, MetaData, ForeignKey, Boolean, \
-    UniqueConstraint, select, alias
-from sqlalchemy.sql import and_, or_
+    UniqueConstraint, Index, select, alias, union, inspect
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.sql import and_, or_, case, func
 from sqlalchemy_utils import create_database, database_exists
-from datetime import datetime
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from heapq import merge
+from itertools import chain, islice
 
-from .config import server_type, server_url, db_user, db_password, database_name, debug
-from .var_utils import get_password_hash, set_utc
+import threading
+
+from .config import server_type, server_url, db_user, db_password, database_name, debug, privilege_cache_size, \
+    pool_size, pool_max_overflow, pool_recycle, users_like_limit, username_index_enabled, username_index_refresh, \
+    recurrence_horizon
+from .recurrence import occurrences, series_end
+from .username_index import UsernameIndex
+from .var_utils import get_password_hash, set_utc, utc_today, LRUCache
+
+
+# indexes of earlier versions no longer used by any query, dropped by upgrade_indexes
+_dropped_indexes = [('events', 'events_end_time')]
+
+
+class _UnitOfWork:
+    def __init__(self, engine):
+        self._engine = engine
+        self._connection = None
+        self._transaction = None
+        self.failed = False
+        self.after_commit = []
+        # (kind, owner_id) counters to bump and change log rows to write at commit, see _write_versions
+        self.version_bumps = []
+        self.changes = []
+        # privileges read in this transaction - kept per thread, so requests never share (or clear) each other's
+        self.privileges = LRUCache(privilege_cache_size)
+
+    @property
+    def connection(self):
+        # checked out of pool and transaction begun on first use, so requests not using database do not hold one
+        if self._connection is None:
+            self._connection = self._engine.connect()
+
+        if self._transaction is None:
+            self._transaction = self._connection.begin()
+
+        return self._connection
+
+    def commit(self):
+        # kept when commit fails, so it can still be rolled back
+        if self._transaction is not None:
+            self._transaction.commit()
+            self._transaction = None
+
+    def rollback(self):
+        if self._transaction is not None:
+            transaction, self._transaction = self._transaction, None
+            transaction.rollback()
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
 
 
 class DatabaseManager:
-    def __init__(self, create_new_if_needed=False):
+    def __init__(self, create_new_if_needed=False, schema_provisioned=False, pool_size=pool_size,
+                 max_overflow=pool_max_overflow):
+        self._pool_size = pool_size
+        self._max_overflow = max_overflow
         self._engine = self._get_engine()
+        self._local = threading.local()
+        self._username_index = UsernameIndex(username_index_refresh) if username_index_enabled else None
 
-        if not database_exists(self._engine.url):
+        if not schema_provisioned and not database_exists(self._engine.url):
             if create_new_if_needed:
                 create_database(self._engine.url)
             else:
                 raise ConnectionError("Database does not exist at given host.")
 
-        metadata = MetaData()
+        self._metadata = metadata = MetaData()
 
         self._users = Table('users', metadata,
                             Column('user_id', Integer, primary_key=True),
@@ -43,7 +102,8 @@ class DatabaseManager:
                              Column('start_time', DateTime, nullable=False),
                              Column('end_time', DateTime, nullable=False),
                              Column('event_timezone', Integer, nullable=False),
-                             Column('all_day_event', Boolean, nullable=False))
+                             Column('all_day_event', Boolean, nullable=False),
+                             Index('calendar_events_window', 'calendar_id', 'start_time', 'end_time'))
 
         self._shares = Table('shares', metadata,
                              Column('share_id', Integer, primary_key=True),
@@ -68,67 +128,405 @@ class DatabaseManager:
                               Column('own_timezone', Integer, nullable=True),
                               Column('own_all_day_event', Boolean, nullable=True),
                               Column('attendance_status', Integer, default=0, nullable=False),
-                              UniqueConstraint('event_id', 'user_id', name='unique_invites'))
-
-        if create_new_if_needed:
+                              UniqueConstraint('event_id', 'user_id', name='unique_invites'),
+                              Index('invites_user_event', 'user_id', 'event_id'))
+
+        # recurrence rule of event being a series, its row holds the first occurrence; last_end is end of the last
+        # occurrence (NULL if series never ends), so finished series are not loaded for later windows
+        self._recurrences = Table('recurrences', metadata,
+                                  Column('event_id', Integer, ForeignKey('events.event_id', ondelete='CASCADE'),
+                                         primary_key=True, autoincrement=False),
+                                  Column('frequency', String(7), nullable=False),
+                                  Column('interval', Integer, nullable=False),
+                                  Column('count', Integer, nullable=True),
+                                  Column('until', DateTime, nullable=True),
+                                  Column('last_end', DateTime, nullable=True))
+
+        # skipped occurrences of series, by their original start
+        self._recurrence_exceptions = Table('recurrence_exceptions', metadata,
+                                            Column('event_id', Integer, ForeignKey('recurrences.event_id',
+                                                                                   ondelete='CASCADE'),
+                                                   primary_key=True, autoincrement=False),
+                                            Column('occurrence_start', DateTime, primary_key=True))
+
+        # change counters of polled lists - 'calendar' (events of calendar), 'calendars' and 'invites' (of user)
+        self._versions = Table('versions', metadata,
+                               Column('kind', String(10), primary_key=True),
+                               Column('owner_id', Integer, primary_key=True, autoincrement=False),
+                               Column('version', Integer, nullable=False))
+
+        # append-only log of calendar changes, ordered per calendar by its 'changes' counter
+        self._changes = Table('changes', metadata,
+                              Column('change_id', Integer, primary_key=True),
+                              Column('calendar_id', Integer, ForeignKey('calendars.calendar_id', ondelete='CASCADE'),
+                                     nullable=False),
+                              Column('version', Integer, nullable=False),
+                              Column('change_time', DateTime, nullable=False),
+                              Column('entity', String(6), nullable=False),
+                              Column('entity_id', Integer, nullable=False),
+                              Column('operation', String(6), nullable=False),
+                              Index('calendar_changes', 'calendar_id', 'version'),
+                              Index('changes_entity', 'calendar_id', 'entity', 'entity_id'))
+
+        # event values as seen by invited user, own values of edited invite override event ones
+        self._invite_start_time = self._effective_invite_value(self._invites.c.own_start_time,
+                                                               self._events.c.start_time)
+        self._invite_end_time = self._effective_invite_value(self._invites.c.own_end_time, self._events.c.end_time)
+
+        self._invite_columns = [
+            self._events.c.event_id,
+            self._effective_invite_value(self._invites.c.own_name, self._events.c.event_name).label('event_name'),
+            self._invite_start_time.label('start_time'), self._invite_end_time.label('end_time'),
+            self._effective_invite_value(self._invites.c.own_timezone, self._events.c.event_timezone).
+            label('event_timezone'),
+            self._effective_invite_value(self._invites.c.own_all_day_event, self._events.c.all_day_event).
+            label('all_day_event'),
+            self._invites.c.invite_id, self._invites.c.is_owner, self._invites.c.attendance_status,
+            self._effective_invite_value(self._invites.c.own_description, self._events.c.event_description).
+            label('description')]
+
+        # moment when invite moves to archive, NULL for series without end
+        self._invite_current_until = case([(self._recurrences.c.event_id == None, self._invite_end_time)],
+                                          else_=self._recurrences.c.last_end)
+
+        self._recurrence_columns = [self._recurrences.c.frequency, self._recurrences.c.interval,
+                                    self._recurrences.c.count, self._recurrences.c.until]
+
+        if create_new_if_needed and not schema_provisioned:
             metadata.create_all(self._engine)
 
+    def upgrade_indexes(self):
+        # create_all skips tables that already exist, so indexes added to (or removed from) them later are applied
+        # to existing databases here
+        inspector = inspect(self._engine)
+        changed = []
+
+        for table in self._metadata.sorted_tables:
+            existing = {index['name'] for index in inspector.get_indexes(table.name)}
+
+            for index in sorted(table.indexes, key=lambda i: i.name):
+                if index.name not in existing:
+                    index.create(self._engine)
+                    changed.append('created ' + index.name)
+
+        for table_name, index_name in _dropped_indexes:
+            if index_name in {index['name'] for index in inspector.get_indexes(table_name)}:
+                with self._engine.connect() as connection:
+                    connection.execute('DROP INDEX {} ON {}'.format(index_name, table_name))
+
+                changed.append('dropped ' + index_name)
+
+        return changed
+
+    def _effective_invite_value(self, own_column, event_column):
+        return func.coalesce(case([(self._invites.c.has_edited == True, own_column)]), event_column)
+
+    @staticmethod
+    def _invite_as_dict(r):
+        return {"event_id": r[0], "event_name": r[1], "start_time": set_utc(r[2]), "end_time": set_utc(r[3]),
+                "event_timezone": r[4], "all_day_event": r[5], "invite_id": r[6], "is_owner": r[7],
+                "attendance": r[8], "description": r[9]}
+
     def _get_engine(self):
         return create_engine(
             "{type}://{user}:{pswd}@{host}/{name}".format(type=server_type, user=db_user, pswd=db_password,
                                                           host=server_url, name=database_name),
-            encoding='utf8', echo=debug)
+            encoding='utf8', echo=debug, pool_size=self._pool_size, max_overflow=self._max_overflow,
+            pool_recycle=pool_recycle)
 
-    def _execute_single_insert(self, _insert):
-        connection = self._engine.connect()
+    def reset_engine(self, pool_size=None, max_overflow=None):
+        # pooled connections inherited from parent process are abandoned, not closed, as parent still uses them
+        self._pool_size = pool_size if pool_size is not None else self._pool_size
+        self._max_overflow = max_overflow if max_overflow is not None else self._max_overflow
+        self._engine = self._get_engine()
+        self._local = threading.local()
 
-        result = connection.execute(_insert)
+    def begin_unit_of_work(self):
+        if getattr(self._local, 'unit', None) is not None:
+            return False
 
-        connection.close()
+        self._local.unit = _UnitOfWork(self._engine)
 
-        return result.inserted_primary_key[0]
+        return True
 
-    def _execute_single_update_delete(self, _query):
-        connection = self._engine.connect()
+    def end_unit_of_work(self, failed=False):
+        unit = getattr(self._local, 'unit', None)
+
+        if unit is None:
+            return
 
-        result = connection.execute(_query)
+        self._local.unit = None
 
-        connection.close()
+        try:
+            if failed or unit.failed:
+                unit.rollback()
+                unit.after_commit = []
+            else:
+                self._write_versions(unit)
+                unit.commit()
+        finally:
+            unit.close()
 
-        return result.rowcount == 1
+        for callback in unit.after_commit:
+            callback()
 
-    def _fetch_single_select(self, _select, mapping=None):
-        connection = self._engine.connect()
+    def commit_unit_of_work(self):
+        # commits changes made so far and runs their after commit callbacks; unit (and its connection) stays open,
+        # e.g. for response streamed afterwards, next use begins new transaction
+        unit = getattr(self._local, 'unit', None)
+
+        if unit is None or unit.failed:
+            return
+
+        try:
+            self._write_versions(unit)
+            unit.commit()
+        except Exception:
+            unit.failed = True
+            raise
 
-        result = connection.execute(_select)
+        callbacks, unit.after_commit = unit.after_commit, []
 
-        connection.close()
+        for callback in callbacks:
+            callback()
 
-        if result.rowcount < 1:
+    def after_commit(self, callback):
+        # outside of unit of work changes are already committed
+        unit = getattr(self._local, 'unit', None)
+
+        if unit is not None:
+            unit.after_commit.append(callback)
+        else:
+            callback()
+
+    def fail_unit_of_work(self):
+        unit = getattr(self._local, 'unit', None)
+
+        if unit is not None:
+            unit.failed = True
+
+    @contextmanager
+    def savepoint(self):
+        # part of unit of work which, if failed, is rolled back without failing the whole unit
+        unit = self._local.unit
+        failed, unit.failed = unit.failed, False
+        callback_count, bump_count, change_count = len(unit.after_commit), len(unit.version_bumps), len(unit.changes)
+        savepoint = unit.connection.begin_nested()
+
+        try:
+            yield
+        except Exception:
+            unit.failed = True
+            raise
+        finally:
+            if unit.failed:
+                savepoint.rollback()
+                del unit.after_commit[callback_count:]
+                del unit.version_bumps[bump_count:]
+                del unit.changes[change_count:]
+                unit.privileges.clear()
+            else:
+                savepoint.commit()
+
+            unit.failed = failed
+
+    @contextmanager
+    def unit_of_work(self):
+        started = self.begin_unit_of_work()
+
+        try:
+            yield
+        except Exception:
+            self._local.unit.failed = True
+            raise
+        finally:
+            if started:
+                self.end_unit_of_work()
+
+    @contextmanager
+    def _connection(self):
+        unit = getattr(self._local, 'unit', None)
+
+        if unit is not None:
+            try:
+                yield unit.connection
+            except Exception:
+                unit.failed = True
+                raise
+        else:
+            connection = self._engine.connect()
+
+            try:
+                yield connection
+            finally:
+                connection.close()
+
+    def _execute_single_insert(self, _insert):
+        with self._connection() as connection:
+            return connection.execute(_insert).inserted_primary_key[0]
+
+    def _execute_single_update_delete(self, _query):
+        with self._connection() as connection:
+            return connection.execute(_query).rowcount == 1
+
+    def _fetch_single_select(self, _select, mapping=None):
+        with self._connection() as connection:
+            result = connection.execute(_select).fetchone()
+
+        if result is None:
             raise ValueError("Given record does not exist in database.")
 
-        return mapping(result.fetchone()) if mapping is not None else result.fetchone()
+        return mapping(result) if mapping is not None else result
 
     def _fetch_many_select(self, _select, mapping=None):
-        connection = self._engine.connect()
+        with self._connection() as connection:
+            result = connection.execute(_select).fetchall()
 
-        result = connection.execute(_select).fetchall()
+        return list(map(mapping, result)) if mapping is not None else result  # 3.4!
 
-        connection.close()
+    def _stream_keyset_select(self, _select, start_column, id_column, mapping, batch_size=500):
+        # successive keyset pages, so only one batch is held in memory - mysqlconnector buffers whole result set,
+        # server-side cursor (stream_results) is not available with it; mapped rows must have start_time and event_id
+        after = None
 
-        return list(map(mapping, result)) if mapping is not None else result  # 3.4!
+        while True:
+            _page = self._keyset_page(_select, start_column, id_column, None, after).\
+                order_by(start_column, id_column).limit(batch_size)
+            rows = self._fetch_many_select(_page, mapping)
+            # taken before rows are handed out, as they are rendered in place
+            last = (rows[-1]['start_time'], rows[-1]['event_id']) if len(rows) == batch_size else None
+
+            for row in rows:
+                yield row
+
+            if last is None:
+                return
+
+            after = last
+
+    def _bump_versions(self, kind, owner_ids):
+        # counters are only queued here and bumped once at commit of unit of work, see _write_versions
+        with self.unit_of_work():
+            self._local.unit.version_bumps.extend((kind, owner_id) for owner_id in owner_ids)
+
+    def _increment_versions(self, connection, keys):
+        _insert = mysql_insert(self._versions).values([{'kind': kind, 'owner_id': owner_id, 'version': 1}
+                                                       for kind, owner_id in keys])
+        _insert = _insert.on_duplicate_key_update(version=self._versions.c.version + 1)
+
+        connection.execute(_insert)
+
+    def _write_versions(self, unit):
+        # all counters bumped by unit of work are locked by one statement in (kind, owner_id) order, so concurrent
+        # transactions always lock them in the same order, whatever order their changes were made in; change log
+        # rows are then numbered with bumped 'changes' counters of their calendars
+        keys, unit.version_bumps = sorted(set(unit.version_bumps)), []
+        changes, unit.changes = unit.changes, []
+
+        if not keys:
+            return
+
+        self._increment_versions(unit.connection, keys)
+
+        if changes:
+            calendar_ids = {change['calendar_id'] for change in changes}
+            _select = select([self._versions.c.owner_id, self._versions.c.version]).\
+                where(and_(self._versions.c.kind == 'changes', self._versions.c.owner_id.in_(calendar_ids)))
+            versions = dict(unit.connection.execute(_select).fetchall())
+
+            unit.connection.execute(self._changes.insert(), [dict(change, version=versions[change['calendar_id']])
+                                                             for change in changes])
+
+    def _set_versions(self, kind, versions):
+        # counters only grow, so older value never overwrites newer one
+        _insert = mysql_insert(self._versions).values([{'kind': kind, 'owner_id': owner_id, 'version': version}
+                                                       for owner_id, version in sorted(versions.items())])
+        _insert = _insert.on_duplicate_key_update(version=func.greatest(self._versions.c.version,
+                                                                        _insert.inserted.version))
+
+        with self._connection() as connection:
+            connection.execute(_insert)
+
+    def _log_changes(self, calendar_id, entity, operation, entity_ids):
+        if not entity_ids:
+            return
+
+        # written at commit, together with bumped 'changes' counter of calendar
+        change_time = datetime.utcnow()
+
+        with self.unit_of_work():
+            self._bump_versions('changes', [calendar_id])
+            self._local.unit.changes.extend({'calendar_id': calendar_id, 'change_time': change_time, 'entity': entity,
+                                             'entity_id': entity_id, 'operation': operation}
+                                            for entity_id in entity_ids)
+
+    def _track_event_change(self, event_id, operation):
+        _select = select([self._events.c.calendar_id]).where(self._events.c.event_id == event_id)
+        calendar_ids = self._fetch_many_select(_select, lambda r: r[0])
+        self._bump_versions('calendar', calendar_ids)
+
+        for calendar_id in calendar_ids:
+            self._log_changes(calendar_id, 'event', operation, [event_id])
+
+        _select = select([self._invites.c.user_id]).where(self._invites.c.event_id == event_id)
+        self._bump_versions('invites', self._fetch_many_select(_select, lambda r: r[0]))
+
+    def _track_guests_change(self, event_id):
+        _select = select([self._events.c.calendar_id]).where(self._events.c.event_id == event_id)
+
+        for calendar_id in self._fetch_many_select(_select, lambda r: r[0]):
+            self._log_changes(calendar_id, 'guests', 'update', [event_id])
+
+    def _bump_calendar_list_versions(self, calendar_id):
+        _select = select([self._calendars.c.owner_id]).where(self._calendars.c.calendar_id == calendar_id).union_all(
+            select([self._shares.c.user_id]).where(self._shares.c.calendar_id == calendar_id))
+        self._bump_versions('calendars', self._fetch_many_select(_select, lambda r: r[0]))
+
+    def _track_share_change(self, share_id, operation):
+        _select = select([self._shares.c.calendar_id, self._shares.c.user_id]).\
+            where(self._shares.c.share_id == share_id)
+
+        for calendar_id, user_id in self._fetch_many_select(_select):
+            self._bump_versions('calendars', [user_id])
+            self._log_changes(calendar_id, 'share', operation, [share_id])
+
+    def get_version(self, kind, owner_id):
+        _select = select([self._versions.c.version]).where(and_(self._versions.c.kind == kind,
+                                                                 self._versions.c.owner_id == owner_id))
+
+        try:
+            version = self._fetch_single_select(_select, lambda r: r[0])
+        except ValueError:
+            version = 0
+
+        # counter bumped by this unit of work, once its changes are committed
+        unit = getattr(self._local, 'unit', None)
+
+        return version + 1 if unit is not None and (kind, owner_id) in unit.version_bumps else version
 
     def add_user(self, username, password, own_timezone):
         _insert = self._users.insert().values(username=username, password=get_password_hash(password),
                                               own_timezone=own_timezone)
 
-        return self._execute_single_insert(_insert)
+        with self.unit_of_work():
+            # single counter of all users, username indexes of all processes reload when it changes
+            self._bump_versions('users', [0])
+            user_id = self._execute_single_insert(_insert)
+
+            if self._username_index is not None:
+                # indexed only once committed, rolled back user must not be found by search
+                self.after_commit(lambda: self._username_index.add_user(user_id, username))
+
+            return user_id
 
     def add_calendar(self, owner_id, calendar_name, calendar_color):
         _insert = self._calendars.insert().values(owner_id=owner_id, calendar_name=calendar_name,
                                                   calendar_color=calendar_color)
 
-        return self._execute_single_insert(_insert)
+        with self.unit_of_work():
+            self._bump_versions('calendars', [owner_id])
+
+            return self._execute_single_insert(_insert)
 
     def add_event(self, calendar_id, event_name, event_description, start_time, end_time, event_timezone,
                   all_day_event):
@@ -137,18 +535,92 @@ class DatabaseManager:
                                                end_time=end_time, event_timezone=event_timezone,
                                                all_day_event=all_day_event)
 
-        return self._execute_single_insert(_insert)
+        with self.unit_of_work():
+            self._bump_versions('calendar', [calendar_id])
+            event_id = self._execute_single_insert(_insert)
+            self._log_changes(calendar_id, 'event', 'insert', [event_id])
+
+            return event_id
+
+    def add_events(self, calendar_id, owner_id, events, chunk_size=1000):
+        event_ids = []
+
+        with self.unit_of_work(), self._connection() as connection:
+            self._bump_versions('calendar', [calendar_id])
+            self._bump_versions('invites', [owner_id])
+
+            for chunk_start in range(0, len(events), chunk_size):
+                chunk = events[chunk_start:chunk_start + chunk_size]
+
+                # one insert per event, as ids of multi-row insert are not guaranteed to be consecutive (interleaved
+                # auto-increment lock mode, auto_increment_increment) - owner invites must get the real ones
+                chunk_ids = [connection.execute(self._events.insert().values(
+                    calendar_id=calendar_id, event_name=event_name, event_description=event_description,
+                    start_time=start_time, end_time=end_time, event_timezone=event_timezone,
+                    all_day_event=all_day_event)).inserted_primary_key[0]
+                    for event_name, event_description, start_time, end_time, event_timezone, all_day_event in chunk]
+
+                connection.execute(self._invites.insert(),
+                                   [{'event_id': event_id, 'user_id': owner_id, 'is_owner': True}
+                                    for event_id in chunk_ids])
+
+                event_ids.extend(chunk_ids)
+
+            self._log_changes(calendar_id, 'event', 'insert', event_ids)
+
+        return event_ids
 
     def add_share(self, calendar_id, user_id, write_permission):
         _insert = self._shares.insert().values(calendar_id=calendar_id, user_id=user_id,
                                                write_permission=write_permission)
 
-        return self._execute_single_insert(_insert)
+        with self.unit_of_work():
+            self._bump_versions('calendars', [user_id])
+            share_id = self._execute_single_insert(_insert)
+            self._log_changes(calendar_id, 'share', 'insert', [share_id])
+
+            return share_id
 
     def add_invite(self, event_id, user_id, is_owner=False):
         _insert = self._invites.insert().values(event_id=event_id, user_id=user_id, is_owner=is_owner)
 
-        return self._execute_single_insert(_insert)
+        with self.unit_of_work():
+            self._bump_versions('invites', [user_id])
+            self._track_guests_change(event_id)
+
+            return self._execute_single_insert(_insert)
+
+    def add_invites(self, event_id, user_ids):
+        with self.unit_of_work():
+            _select = select([self._invites.c.user_id, self._invites.c.invite_id]).where(
+                and_(self._invites.c.event_id == event_id, self._invites.c.user_id.in_(user_ids)))
+
+            already_invited = dict(self._fetch_many_select(_select, lambda r: (r[0], r[1])))
+
+            _select = select([self._users.c.user_id]).where(
+                self._users.c.user_id.in_([u for u in user_ids if u not in already_invited]))
+
+            new_user_ids = self._fetch_many_select(_select, lambda r: r[0])
+
+            if new_user_ids:
+                self._bump_versions('invites', new_user_ids)
+                self._track_guests_change(event_id)
+
+                _insert = self._invites.insert().prefix_with('IGNORE', dialect='mysql').values(
+                    [{'event_id': event_id, 'user_id': user_id, 'is_owner': False, 'has_edited': False}
+                     for user_id in new_user_ids])
+
+                with self._connection() as connection:
+                    connection.execute(_insert)
+
+                _select = select([self._invites.c.user_id, self._invites.c.invite_id]).where(
+                    and_(self._invites.c.event_id == event_id, self._invites.c.user_id.in_(new_user_ids)))
+
+                new_invites = dict(self._fetch_many_select(_select, lambda r: (r[0], r[1])))
+            else:
+                new_invites = {}
+
+        return new_invites, already_invited
 
     def get_user_data(self, username):
         _select = self._users.select(self._users.c.username == username)
@@ -156,8 +628,31 @@ class DatabaseManager:
         return self._fetch_single_select(_select, lambda r: {"user_id": r[0], "username": r[1], "password": r[2],
                                                              "tz": r[3]})
 
-    def get_users_like(self, like_string):
-        _select = self._users.select(self._users.c.username.like('%' + like_string + '%'))
+    def _refresh_username_index(self):
+        # version is read before users, so concurrent change can only cause one more reload
+        version = self.get_version('users', 0)
+
+        if version == self._username_index.version:
+            self._username_index.mark_refreshed()
+        else:
+            _select = select([self._users.c.user_id, self._users.c.username])
+            self._username_index.reload(self._fetch_many_select(_select, lambda r: (r[0], r[1])), version)
+
+    @staticmethod
+    def _escape_like(value):
+        return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+    def get_users_like(self, like_string, limit=users_like_limit, prefix=False):
+        if prefix and self._username_index is not None:
+            if self._username_index.needs_refresh():
+                self._refresh_username_index()
+
+            return self._username_index.prefix(like_string, limit)
+
+        _select = select([self._users.c.user_id, self._users.c.username]).where(
+            self._users.c.username.like((self._escape_like(like_string) + '%') if prefix else
+                                        ('%' + self._escape_like(like_string) + '%'), escape='\\')).\
+            order_by(self._users.c.username).limit(limit)
 
         return self._fetch_many_select(_select, lambda r: {"user_id": r[0], "username": r[1]})
 
@@ -186,95 +681,352 @@ class DatabaseManager:
         return {"my_calendars": own_calendars, "shared_with_me": shared_calendars}
 
     def get_user_calendar_privilege(self, user_id, calendar_id):
-        _select = select([self._calendars.c.owner_id]).where(self._calendars.c.calendar_id == calendar_id)
+        # cached only within unit of work, outside of it every check reads current state
+        unit = getattr(self._local, 'unit', None)
+        privilege = unit.privileges.get((user_id, calendar_id)) if unit is not None else None
+
+        if privilege is not None:
+            return privilege
+
+        _select = select([self._calendars.c.owner_id, self._shares.c.write_permission]).select_from(
+            self._calendars.outerjoin(self._shares, and_(self._shares.c.calendar_id == self._calendars.c.calendar_id,
+                                                         self._shares.c.user_id == user_id))).\
+            where(self._calendars.c.calendar_id == calendar_id)
+
+        result = self._fetch_many_select(_select)
+
+        if not result:
+            privilege = 0
+        elif result[0][0] == user_id:
+            privilege = 3
+        elif result[0][1] is None:
+            privilege = 0
+        else:
+            privilege = 2 if result[0][1] else 1
+
+        if unit is not None:
+            unit.privileges.put((user_id, calendar_id), privilege)
+
+        return privilege
+
+    def invalidate_calendar_privileges(self, calendar_id, user_id=None):
+        unit = getattr(self._local, 'unit', None)
+
+        if unit is not None:
+            unit.privileges.invalidate(lambda k: k[1] == calendar_id and (user_id is None or k[0] == user_id))
+
+    def _keyset_page(self, _select, start_column, id_column, limit=None, after=None):
+        if after is not None:
+            _select = _select.where(or_(start_column > after[0], and_(start_column == after[0], id_column > after[1])))
+
+        if limit is not None:
+            _select = _select.order_by(start_column, id_column).limit(limit + 1)
+
+        return _select
+
+    def _series_window(self, start_column, from_time, to_time, *unbounded):
+        # series starting before window end and not finished before its start; unbounded conditions mark series
+        # whose last_end can not be trusted (e.g. shifted by own invite times)
+        _window = []
+
+        if to_time is not None:
+            _window.append(start_column < to_time)
+
+        if from_time is not None:
+            _window.append(or_(self._recurrences.c.last_end == None, self._recurrences.c.last_end > from_time,
+                               *unbounded))
+
+        return _window
+
+    @staticmethod
+    def _recurrence_rule(r):
+        return r[0], r[1], r[2], set_utc(r[3]) if r[3] is not None else None
+
+    def _get_recurrence_exceptions(self, event_ids):
+        exceptions = {event_id: set() for event_id in event_ids}
+
+        if exceptions:
+            _select = select([self._recurrence_exceptions.c.event_id, self._recurrence_exceptions.c.occurrence_start]).\
+                where(self._recurrence_exceptions.c.event_id.in_(list(exceptions)))
+
+            for event_id, occurrence_start in self._fetch_many_select(_select):
+                exceptions[event_id].add(set_utc(occurrence_start))
+
+        return exceptions
+
+    def _with_occurrences(self, rows, series, from_time, to_time, limit=None, after=None, stream=False,
+                          ordered=False, horizon_start=None):
+        # single events (ordered when paged) merged with occurrences of series expanded lazily for the window;
+        # occurrences share event_id of their series, but not start_time, so they are paged by the same keyset
+        if not series:
+            return rows
+
+        # horizon of window without start is counted from start of the day, so list stays the same whole day
+        if to_time is None:
+            to_time = (from_time or horizon_start or utc_today()) + timedelta(days=recurrence_horizon)
+
+        exceptions = self._get_recurrence_exceptions([event_dict['event_id'] for event_dict, _ in series])
 
-        connection = self._engine.connect()
+        def _occurrences(event_dict, rule):
+            for start_time, end_time in occurrences(event_dict['start_time'], event_dict['end_time'],
+                                                    event_dict['event_timezone'], *rule,
+                                                    exceptions=exceptions[event_dict['event_id']],
+                                                    from_time=from_time, to_time=to_time,
+                                                    not_before=after[0] if after is not None else None):
+                if after is None or start_time > after[0] or event_dict['event_id'] > after[1]:
+                    yield dict(event_dict, start_time=start_time, end_time=end_time)
 
-        result = connection.execute(_select).fetchone()
+        expanded = [_occurrences(event_dict, rule) for event_dict, rule in series]
 
-        if result is not None and result[0] == user_id:
-            connection.close()
-            return 3
+        if limit is not None:
+            return list(islice(merge(rows, *expanded, key=lambda e: (e['start_time'], e['event_id'])), limit + 1))
 
-        _select = select([self._shares.c.write_permission]).where(and_(self._shares.c.calendar_id == calendar_id,
-                                                                       self._shares.c.user_id == user_id))
+        if ordered:
+            events = merge(rows, *expanded, key=lambda e: (e['start_time'], e['event_id']))
+        else:
+            events = chain(rows, *expanded)
+
+        return events if stream else list(events)
+
+    def get_calendar_events(self, calendar_id, from_time=None, to_time=None, limit=None, after=None, stream=False,
+                            event_ids=None, horizon_start=None):
+        _columns = [self._events.c.event_id, self._events.c.event_name, self._events.c.start_time,
+                    self._events.c.end_time, self._events.c.event_timezone, self._events.c.all_day_event,
+                    self._events.c.event_description, self._recurrences.c.event_id]
+
+        def _as_dict(r):
+            return {"event_id": r[0], "event_name": r[1], "start_time": set_utc(r[2]), "end_time": set_utc(r[3]),
+                    "event_timezone": r[4], "all_day_event": r[5], "event_description": r[6],
+                    "recurring": r[7] is not None}
+
+        if event_ids is not None:
+            # changed events are returned as stored, series by their first occurrence
+            _select = select(_columns).select_from(self._events.outerjoin(self._recurrences)).\
+                where(and_(self._events.c.calendar_id == calendar_id, self._events.c.event_id.in_(event_ids)))
+
+            return self._fetch_many_select(_select, _as_dict)
+
+        _where = [self._events.c.calendar_id == calendar_id, self._recurrences.c.event_id == None]
 
-        result = connection.execute(_select)
-        connection.close()
+        # overlap predicate, served by calendar_events_window index
+        if from_time is not None:
+            _where.append(self._events.c.end_time > from_time)
 
-        if result.rowcount > 0:
-            return 2 if result.fetchone()[0] else 1
+        if to_time is not None:
+            _where.append(self._events.c.start_time < to_time)
+
+        _select = select(_columns).select_from(self._events.outerjoin(self._recurrences)).where(and_(*_where))
+        _select = self._keyset_page(_select, self._events.c.start_time, self._events.c.event_id, limit, after)
+
+        _series = select(_columns + self._recurrence_columns).\
+            select_from(self._events.join(self._recurrences)).\
+            where(and_(self._events.c.calendar_id == calendar_id,
+                       *self._series_window(self._events.c.start_time, from_time, to_time)))
+
+        series = self._fetch_many_select(_series, lambda r: (_as_dict(r), self._recurrence_rule(r[8:])))
+
+        if stream:
+            rows = self._stream_keyset_select(_select, self._events.c.start_time, self._events.c.event_id, _as_dict)
+        else:
+            rows = self._fetch_many_select(_select, _as_dict)
+
+        # streamed rows may be continued from cursor of the last one sent, so occurrences are merged in order
+        return self._with_occurrences(rows, series, from_time, to_time, limit, after, stream, ordered=stream,
+                                      horizon_start=horizon_start)
+
+    def _agenda_select(self, user_id, from_time, to_time, recurring):
+        # events of owned and shared calendars are found by their own times through calendar_events_window index,
+        # invited ones by times as seen by the user; outer query drops those moved out of window by own invite times
+        if recurring:
+            _events = self._events.join(self._recurrences)
+            _window = self._series_window(self._events.c.start_time, from_time, to_time)
+            _invite_window = self._series_window(self._invite_start_time, from_time, to_time,
+                                                 self._invites.c.has_edited == True)
+        else:
+            _events = self._events
+            _window, _invite_window = [], []
+
+            if from_time is not None:
+                _window.append(self._events.c.end_time > from_time)
+                _invite_window.append(self._invite_end_time > from_time)
+
+            if to_time is not None:
+                _window.append(self._events.c.start_time < to_time)
+                _invite_window.append(self._invite_start_time < to_time)
+
+        _visible = union(
+            select([self._events.c.event_id]).select_from(_events.join(self._calendars)).
+            where(and_(self._calendars.c.owner_id == user_id, *_window)),
+            select([self._events.c.event_id]).select_from(
+                _events.join(self._shares, self._shares.c.calendar_id == self._events.c.calendar_id)).
+            where(and_(self._shares.c.user_id == user_id, *_window)),
+            select([self._invites.c.event_id]).select_from(_events.join(self._invites)).
+            where(and_(self._invites.c.user_id == user_id, *_invite_window))).alias('visible')
+
+        return select([self._events.c.event_id, self._events.c.calendar_id,
+                       self._effective_invite_value(self._invites.c.own_name, self._events.c.event_name),
+                       self._invite_start_time, self._invite_end_time,
+                       self._effective_invite_value(self._invites.c.own_timezone, self._events.c.event_timezone),
+                       self._effective_invite_value(self._invites.c.own_all_day_event,
+                                                    self._events.c.all_day_event),
+                       self._effective_invite_value(self._invites.c.own_description,
+                                                    self._events.c.event_description),
+                       self._invites.c.invite_id, self._invites.c.attendance_status] + self._recurrence_columns).\
+            select_from(self._events.join(_visible, _visible.c.event_id == self._events.c.event_id).
+                        outerjoin(self._invites, and_(self._invites.c.event_id == self._events.c.event_id,
+                                                      self._invites.c.user_id == user_id)).
+                        outerjoin(self._recurrences)).\
+            where(and_(self._recurrences.c.event_id != None if recurring else self._recurrences.c.event_id == None,
+                       *_invite_window))
+
+    def get_agenda(self, user_id, from_time=None, to_time=None, limit=None, after=None, stream=False):
+        def _as_dict(r):
+            return {"event_id": r[0], "calendar_id": r[1], "event_name": r[2], "start_time": set_utc(r[3]),
+                    "end_time": set_utc(r[4]), "event_timezone": r[5], "all_day_event": r[6],
+                    "event_description": r[7], "invite_id": r[8], "attendance": r[9], "recurring": r[10] is not None}
+
+        _select = self._keyset_page(self._agenda_select(user_id, from_time, to_time, False), self._invite_start_time,
+                                    self._events.c.event_id, limit, after)
+
+        series = self._fetch_many_select(self._agenda_select(user_id, from_time, to_time, True),
+                                         lambda r: (_as_dict(r), self._recurrence_rule(r[10:])))
+
+        if stream:
+            rows = self._stream_keyset_select(_select, self._invite_start_time, self._events.c.event_id, _as_dict)
+        elif limit is None:
+            rows = self._fetch_many_select(_select.order_by(self._invite_start_time, self._events.c.event_id),
+                                           _as_dict)
         else:
-            return 0
+            rows = self._fetch_many_select(_select, _as_dict)
 
-    def get_calendar_events(self, calendar_id):
-        _select = select([self._events.c.event_id, self._events.c.event_name, self._events.c.start_time,
-                          self._events.c.end_time, self._events.c.event_timezone, self._events.c.all_day_event,
-                          self._events.c.event_description]). \
-            where(self._events.c.calendar_id == calendar_id)
+        return self._with_occurrences(rows, series, from_time, to_time, limit, after, stream,
+                                      ordered=True)
 
-        return self._fetch_many_select(_select, lambda r: {"event_id": r[0], "event_name": r[1],
-                                                           "start_time": set_utc(r[2]), "end_time": set_utc(r[3]),
-                                                           "event_timezone": r[4], "all_day_event": r[5],
-                                                           "event_description": r[6]})
+    def get_busy_times(self, user_ids, from_time, to_time):
+        # events users own (by owner invite, not by calendar) or attend, with their own times if they edited the invite
+        _busy = [self._invites.c.user_id.in_(user_ids),
+                 or_(self._invites.c.is_owner == True, self._invites.c.attendance_status == 3)]
+
+        _select = select([self._invites.c.user_id, self._invite_start_time, self._invite_end_time]).\
+            select_from(self._events.join(self._invites).outerjoin(self._recurrences)).\
+            where(and_(self._recurrences.c.event_id == None, self._invite_end_time > from_time,
+                       self._invite_start_time < to_time, *_busy))
+
+        _series = select([self._invites.c.user_id, self._invite_start_time, self._invite_end_time,
+                          self._effective_invite_value(self._invites.c.own_timezone, self._events.c.event_timezone),
+                          self._events.c.event_id] + self._recurrence_columns).\
+            select_from(self._events.join(self._invites).join(self._recurrences)).\
+            where(and_(*(self._series_window(self._invite_start_time, from_time, to_time,
+                                             self._invites.c.has_edited == True) + _busy)))
+
+        busy_times = self._fetch_many_select(_select, lambda r: (r[0], set_utc(r[1]), set_utc(r[2])))
+        series = self._fetch_many_select(_series)
+        exceptions = self._get_recurrence_exceptions([r[4] for r in series])
+
+        for r in series:
+            busy_times.extend((r[0], start_time, end_time) for start_time, end_time in occurrences(
+                set_utc(r[1]), set_utc(r[2]), r[3], *self._recurrence_rule(r[5:]), exceptions=exceptions[r[4]],
+                from_time=from_time, to_time=to_time))
+
+        return busy_times
+
+    def get_users_timezones(self, user_ids):
+        _select = select([self._users.c.user_id, self._users.c.own_timezone]).where(
+            self._users.c.user_id.in_(user_ids))
+
+        return dict(self._fetch_many_select(_select, lambda r: (r[0], r[1])))
 
     def get_invite(self, user_id, invite_id):
-        _select = select([self._events.c.event_id, self._events.c.event_name, self._events.c.start_time,
-                          self._events.c.end_time, self._events.c.event_timezone, self._events.c.all_day_event,
-                          self._invites.c.invite_id, self._invites.c.is_owner, self._invites.c.has_edited,
-                          self._invites.c.own_name, self._invites.c.own_start_time, self._invites.c.own_end_time,
-                          self._invites.c.own_all_day_event, self._invites.c.attendance_status,
-                          self._events.c.event_description, self._invites.c.own_description,
-                          self._invites.c.own_timezone]). \
-            select_from(self._events.join(self._invites)).where(
+        _select = select(self._invite_columns).select_from(self._events.join(self._invites)).where(
             and_(self._invites.c.user_id == user_id, self._invites.c.invite_id == invite_id))
 
-        return self._fetch_single_select(_select,
-                                         lambda r: {"event_id": r[0],
-                                                    "event_name": r[9] if r[8] and r[9] is not None else r[1],
-                                                    "start_time": set_utc(
-                                                        r[10] if r[8] and r[10] is not None else r[2]),
-                                                    "end_time": set_utc(r[11] if r[8] and r[11] is not None else r[3]),
-                                                    "event_timezone": r[16] if r[8] and r[16] is not None else r[4],
-                                                    "all_day_event": r[12] if r[8] and r[12] is not None else r[5],
-                                                    "invite_id": r[6],
-                                                    "is_owner": r[7],
-                                                    "attendance": r[13],
-                                                    "description": r[15] if r[8] and r[15] is not None else r[14]})
-
-    def get_invites(self, user_id, archive=False):
-        _or_clause = or_(self._events.c.end_time > datetime.utcnow() if not archive else
-                             self._events.c.end_time < datetime.utcnow(),
-                         self._invites.c.own_end_time > datetime.utcnow() if not archive else
-                             self._invites.c.own_end_time > datetime.utcnow())
-
-        _select = select([self._events.c.event_id, self._events.c.event_name, self._events.c.start_time,
-                          self._events.c.end_time, self._events.c.event_timezone, self._events.c.all_day_event,
-                          self._invites.c.invite_id, self._invites.c.is_owner, self._invites.c.has_edited,
-                          self._invites.c.own_name, self._invites.c.own_start_time, self._invites.c.own_end_time,
-                          self._invites.c.own_all_day_event, self._invites.c.attendance_status,
-                          self._events.c.event_description, self._invites.c.own_description,
-                          self._invites.c.own_timezone]). \
-            select_from(self._events.join(self._invites)).where(
-            and_(self._invites.c.user_id == user_id, _or_clause))
-
-        return self._fetch_many_select(_select,
-                                       lambda r: {"event_id": r[0],
-                                                  "event_name": r[9] if r[8] and r[9] is not None else r[1],
-                                                  "start_time": set_utc(r[10] if r[8] and r[10] is not None else r[2]),
-                                                  "end_time": set_utc(r[11] if r[8] and r[11] is not None else r[3]),
-                                                  "event_timezone": r[16] if r[8] and r[16] is not None else r[4],
-                                                  "all_day_event": r[12] if r[8] and r[12] is not None else r[5],
-                                                  "invite_id": r[6],
-                                                  "is_owner": r[7],
-                                                  "attendance": r[13],
-                                                  "description": r[15] if r[8] and r[15] is not None else r[14]})
+        return self._fetch_single_select(_select, self._invite_as_dict)
+
+    def get_invites(self, user_id, archive=False, limit=None, after=None, stream=False):
+        now = datetime.utcnow()
+
+        # invite to a series is archived once its last occurrence ends
+        _select = select(self._invite_columns).select_from(self._events.join(self._invites).
+                                                           outerjoin(self._recurrences)).where(
+            and_(self._invites.c.user_id == user_id,
+                 self._invite_current_until <= now if archive else
+                 or_(self._invite_current_until > now,
+                     and_(self._recurrences.c.event_id != None, self._recurrences.c.last_end == None))))
+
+        _select = self._keyset_page(_select, self._invite_start_time, self._events.c.event_id, limit, after)
+
+        if stream:
+            return self._stream_keyset_select(_select, self._invite_start_time, self._events.c.event_id,
+                                              self._invite_as_dict)
+
+        return self._fetch_many_select(_select, self._invite_as_dict)
+
+    def get_next_invite_end_time(self, user_id, now):
+        # moment when one of user's invites moves to archive, None if all are finished already
+        _select = select([func.min(self._invite_current_until)]).\
+            select_from(self._events.join(self._invites).outerjoin(self._recurrences)).\
+            where(and_(self._invites.c.user_id == user_id, self._invite_current_until > now))
+
+        return self._fetch_single_select(_select, lambda r: r[0])
+
+    def get_changes(self, calendar_id, since):
+        _select = select([self._changes.c.version, self._changes.c.entity, self._changes.c.entity_id,
+                          self._changes.c.operation]).\
+            where(and_(self._changes.c.calendar_id == calendar_id, self._changes.c.version > since)).\
+            order_by(self._changes.c.version, self._changes.c.change_id)
+
+        return self._fetch_many_select(_select, lambda r: (r[0], r[1], r[2], r[3]))
+
+    def compact_changes(self, older_than, batch_size=1000):
+        removed = 0
+
+        # only last change of each entity is needed to bring any client up to date
+        _newer = alias(self._changes, 'newer')
+        _select = select([self._changes.c.change_id]).distinct().select_from(
+            self._changes.join(_newer, and_(_newer.c.calendar_id == self._changes.c.calendar_id,
+                                            _newer.c.entity == self._changes.c.entity,
+                                            _newer.c.entity_id == self._changes.c.entity_id,
+                                            _newer.c.change_id > self._changes.c.change_id))).limit(batch_size)
+
+        while True:
+            with self.unit_of_work():
+                change_ids = self._fetch_many_select(_select, lambda r: r[0])
+
+                if change_ids:
+                    _delete = self._changes.delete().where(self._changes.c.change_id.in_(change_ids))
+
+                    with self._connection() as connection:
+                        removed += connection.execute(_delete).rowcount
+
+            if len(change_ids) < batch_size:
+                break
+
+        # clients synced before removed entries have to fetch whole calendar, 'compacted' counter marks that point
+        _select = select([self._changes.c.calendar_id, func.max(self._changes.c.version)]).\
+            where(self._changes.c.change_time < older_than).group_by(self._changes.c.calendar_id)
+
+        with self.unit_of_work():
+            watermarks = dict(self._fetch_many_select(_select, lambda r: (r[0], r[1])))
+
+            if watermarks:
+                self._set_versions('compacted', watermarks)
+
+                with self._connection() as connection:
+                    for calendar_id, version in watermarks.items():
+                        removed += connection.execute(self._changes.delete().where(
+                            and_(self._changes.c.calendar_id == calendar_id,
+                                 self._changes.c.version <= version))).rowcount
+
+        return removed
 
     def update_calendar(self, calendar_id, calendar_name, calendar_color):
         _update = self._calendars.update().where(self._calendars.c.calendar_id == calendar_id).\
             values(calendar_name=calendar_name, calendar_color=calendar_color)
 
-        return self._execute_single_update_delete(_update)
+        with self.unit_of_work():
+            self._bump_calendar_list_versions(calendar_id)
+
+            return self._execute_single_update_delete(_update)
 
     def update_event(self, event_id, event_name, event_description, start_time, end_time, event_timezone,
                      all_day_event):
@@ -282,7 +1034,67 @@ class DatabaseManager:
             values(event_name=event_name, event_description=event_description, start_time=start_time, end_time=end_time,
                    event_timezone=event_timezone, all_day_event=all_day_event)
 
-        return self._execute_single_update_delete(_update)
+        with self.unit_of_work():
+            self._track_event_change(event_id, 'update')
+            updated = self._execute_single_update_delete(_update)
+            self._update_series_end(event_id)
+
+            return updated
+
+    def _update_series_end(self, event_id):
+        _select = select([self._events.c.start_time, self._events.c.end_time, self._events.c.event_timezone] +
+                         self._recurrence_columns).select_from(self._events.join(self._recurrences)).\
+            where(self._events.c.event_id == event_id)
+
+        for r in self._fetch_many_select(_select):
+            last_end = series_end(set_utc(r[0]), set_utc(r[1]), r[2], *self._recurrence_rule(r[3:]))
+
+            with self._connection() as connection:
+                connection.execute(self._recurrences.update().where(self._recurrences.c.event_id == event_id).
+                                   values(last_end=last_end))
+
+    def set_recurrence(self, event_id, frequency, interval, count, until):
+        # replaces rule of a series, skipped occurrences are kept
+        _update = self._recurrences.update().where(self._recurrences.c.event_id == event_id).\
+            values(frequency=frequency, interval=interval, count=count, until=until)
+
+        with self.unit_of_work():
+            self._track_event_change(event_id, 'update')
+
+            if not self._execute_single_update_delete(_update):
+                self._execute_single_insert(self._recurrences.insert().values(
+                    event_id=event_id, frequency=frequency, interval=interval, count=count, until=until))
+
+            self._update_series_end(event_id)
+
+    def get_recurrence(self, event_id):
+        _select = select(self._recurrence_columns).where(self._recurrences.c.event_id == event_id)
+
+        try:
+            frequency, interval, count, until = self._fetch_single_select(_select, self._recurrence_rule)
+        except ValueError:
+            return None
+
+        return {"frequency": frequency, "interval": interval, "count": count, "until": until,
+                "exceptions": sorted(self._get_recurrence_exceptions([event_id])[event_id])}
+
+    def delete_recurrence(self, event_id):
+        _delete = self._recurrences.delete().where(self._recurrences.c.event_id == event_id)
+
+        with self.unit_of_work():
+            self._track_event_change(event_id, 'update')
+
+            return self._execute_single_update_delete(_delete)
+
+    def add_recurrence_exception(self, event_id, occurrence_start):
+        _insert = self._recurrence_exceptions.insert().prefix_with('IGNORE', dialect='mysql').\
+            values(event_id=event_id, occurrence_start=occurrence_start)
+
+        with self.unit_of_work():
+            self._track_event_change(event_id, 'update')
+
+            with self._connection() as connection:
+                connection.execute(_insert)
 
     def get_user_shares(self, user_id):
         _filtered_calendars = alias(select([self._calendars.c.calendar_name, self._calendars.c.calendar_color,
@@ -301,7 +1113,10 @@ class DatabaseManager:
         _update = self._shares.update().where(self._shares.c.share_id == share_id).\
             values(write_permission=write_permission)
 
-        return self._execute_single_update_delete(_update)
+        with self.unit_of_work():
+            self._track_share_change(share_id, 'update')
+
+            return self._execute_single_update_delete(_update)
 
     def update_invite_description(self, user_id, invite_id, own_name, own_description, own_start_time, own_end_time,
                                   own_all_day_event):
@@ -310,7 +1125,10 @@ class DatabaseManager:
             values(own_name=own_name, own_description=own_description, own_start_time=own_start_time,
                    own_end_time=own_end_time, own_all_day_event=own_all_day_event, has_edited=True)
 
-        return self._execute_single_update_delete(_update)
+        with self.unit_of_work():
+            self._bump_versions('invites', [user_id])
+
+            return self._execute_single_update_delete(_update)
 
     def restore_default_event_data(self, user_id, invite_id):
         _update = self._invites.update().where(and_(self._invites.c.invite_id == invite_id,
@@ -318,29 +1136,56 @@ class DatabaseManager:
             values(own_name=None, own_description=None, own_start_time=None, own_end_time=None, own_all_day_event=None,
                    has_edited=False)
 
-        return self._execute_single_update_delete(_update)
+        with self.unit_of_work():
+            self._bump_versions('invites', [user_id])
+
+            return self._execute_single_update_delete(_update)
 
     def update_invite_attendance(self, user_id, invite_id, attendance):
         _update = self._invites.update().where(and_(self._invites.c.invite_id == invite_id,
                                                     self._invites.c.user_id == user_id)).\
             values(attendance_status=attendance)
 
-        return self._execute_single_update_delete(_update)
+        with self.unit_of_work():
+            self._bump_versions('invites', [user_id])
+
+            _select = select([self._invites.c.event_id]).where(and_(self._invites.c.invite_id == invite_id,
+                                                                     self._invites.c.user_id == user_id))
+
+            for event_id in self._fetch_many_select(_select, lambda r: r[0]):
+                self._track_guests_change(event_id)
+
+            return self._execute_single_update_delete(_update)
 
     def delete_calendar(self, calendar_id):
         _delete = self._calendars.delete().where(self._calendars.c.calendar_id == calendar_id)
 
-        return self._execute_single_update_delete(_delete)
+        # counters are bumped before delete, as calendar events, invites and shares are removed with it
+        with self.unit_of_work():
+            self._bump_versions('calendar', [calendar_id])
+            self._bump_calendar_list_versions(calendar_id)
+
+            _select = select([self._invites.c.user_id]).distinct().select_from(self._invites.join(self._events)).\
+                where(self._events.c.calendar_id == calendar_id)
+            self._bump_versions('invites', self._fetch_many_select(_select, lambda r: r[0]))
+
+            return self._execute_single_update_delete(_delete)
 
     def delete_event(self, event_id):
         _delete = self._events.delete().where(self._events.c.event_id == event_id)
 
-        return self._execute_single_update_delete(_delete)
+        with self.unit_of_work():
+            self._track_event_change(event_id, 'delete')
+
+            return self._execute_single_update_delete(_delete)
 
     def delete_share(self, share_id):
         _delete = self._shares.delete().where(self._shares.c.share_id == share_id)
 
-        return self._execute_single_update_delete(_delete)
+        with self.unit_of_work():
+            self._track_share_change(share_id, 'delete')
+
+            return self._execute_single_update_delete(_delete)
 
     def get_event(self, event_id):
         _select = self._events.select(self._events.c.event_id == event_id)
@@ -371,19 +1216,48 @@ class DatabaseManager:
 
         return self._fetch_single_select(_select, lambda r: r[0])
 
+    def get_event_user_ids(self, event_id):
+        _select = select([self._invites.c.user_id]).where(self._invites.c.event_id == event_id)
+
+        return self._fetch_many_select(_select, lambda r: r[0])
+
     def get_event_guests(self, event_id):
-        guests = {}
+        return self.get_guests_for_events([event_id])[event_id]
 
-        for attendance_status, attendance_id in zip(['unknown', 'no', 'maybe', 'yes'], range(0, 4)):
-            _alias = alias(select([self._invites.c.user_id]).where(
-                and_(self._invites.c.event_id == event_id, self._invites.c.attendance_status == attendance_id)))
-            _select = select([self._users.c.username]).select_from(self._users.join(_alias, _alias.c.user_id ==
-                                                                                    self._users.c.user_id))
+    def get_guests_for_events(self, event_ids):
+        attendance_statuses = ['unknown', 'no', 'maybe', 'yes']
+        guests = {event_id: {attendance_status: [] for attendance_status in attendance_statuses}
+                  for event_id in event_ids}
 
-            guests[attendance_status] = self._fetch_many_select(_select, lambda r: r[0])
+        if not guests:
+            return guests
+
+        _select = select([self._invites.c.event_id, self._invites.c.attendance_status, self._users.c.username]).\
+            select_from(self._invites.join(self._users, self._invites.c.user_id == self._users.c.user_id)).\
+            where(self._invites.c.event_id.in_(guests.keys())).\
+            order_by(self._invites.c.event_id, self._invites.c.attendance_status)
+
+        for event_id, attendance_id, username in self._fetch_many_select(_select):
+            guests[event_id][attendance_statuses[attendance_id]].append(username)
 
         return guests
 
+    def get_visible_event_ids(self, user_id, event_ids):
+        if not event_ids:
+            return []
+
+        _select = select([self._events.c.event_id]).select_from(
+            self._events.join(self._calendars, self._events.c.calendar_id == self._calendars.c.calendar_id).
+            outerjoin(self._shares, and_(self._shares.c.calendar_id == self._events.c.calendar_id,
+                                         self._shares.c.user_id == user_id)).
+            outerjoin(self._invites, and_(self._invites.c.event_id == self._events.c.event_id,
+                                          self._invites.c.user_id == user_id))).\
+            where(and_(self._events.c.event_id.in_(event_ids),
+                       or_(self._calendars.c.owner_id == user_id, self._shares.c.share_id != None,
+                           self._invites.c.invite_id != None)))
+
+        return self._fetch_many_select(_select, lambda r: r[0])
+
     def get_invite_for_user_at_event(self, user_id, event_id):
         _select = self._invites.select(and_(self._invites.c.user_id == user_id, self._invites.c.event_id == event_id))
 
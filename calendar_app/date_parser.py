@@ -0,0 +1,46 @@
+import re
+
+from datetime import datetime, timedelta, timezone
+
+from .var_utils import get_timezone
+
+_format = "%Y-%m-%d %H:%M:%S"
+_format_with_offset = "%Y-%m-%d %H:%M:%S %z"
+
+# only plain "YYYY-MM-DD HH:MM:SS[ +HHMM]" goes through fast path, any other layout strptime accepts is left to it
+_pattern = re.compile(r"(\d{4})-(\d\d)-(\d\d) (\d\d):(\d\d):(\d\d)", re.ASCII)
+_pattern_with_offset = re.compile(r"(\d{4})-(\d\d)-(\d\d) (\d\d):(\d\d):(\d\d) ([+-])(\d\d)([0-5]\d)", re.ASCII)
+
+
+def parse_datetime(value, with_offset=False):
+    """Parses API date, equivalent to strptime with "%Y-%m-%d %H:%M:%S" or "%Y-%m-%d %H:%M:%S %z" format."""
+    match = (_pattern_with_offset if with_offset else _pattern).fullmatch(value) if type(value) is str else None
+
+    if match is not None:
+        try:
+            if with_offset:
+                sign = -1 if match[7] == '-' else 1
+                hours, minutes = sign * int(match[8]), sign * int(match[9])
+                tzinfo = get_timezone(hours) if minutes == 0 else timezone(timedelta(hours=hours, minutes=minutes))
+            else:
+                tzinfo = None
+
+            return datetime(int(match[1]), int(match[2]), int(match[3]), int(match[4]), int(match[5]), int(match[6]),
+                            tzinfo=tzinfo)
+        except ValueError:
+            pass
+
+    return datetime.strptime(value, _format_with_offset if with_offset else _format)
+
+
+def parse_datetimes(values, with_offset=False):
+    """Parses many API dates at once, e.g. of bulk import; values parse_datetime rejects give None."""
+    results = []
+
+    for value in values:
+        try:
+            results.append(parse_datetime(value, with_offset))
+        except (TypeError, ValueError):
+            results.append(None)
+
+    return results
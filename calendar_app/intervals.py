@@ -0,0 +1,68 @@
+from heapq import merge
+
+day_seconds = 24 * 3600
+
+
+def merge_intervals(intervals):
+    # sorted, non-overlapping union of (start, end) intervals, touching ones are joined; O(n log n) for the sort
+    merged = []
+
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
+
+    return merged
+
+
+def clip_intervals(intervals, window_start, window_end):
+    # merged intervals cut to given window
+    return [[max(start, window_start), min(end, window_end)] for start, end in intervals
+            if end > window_start and start < window_end]
+
+
+def off_hours(window_start, window_end, work_from, work_to, utc_offset):
+    # sorted intervals outside of daily working hours [work_from, work_to) (hours of local day, utc_offset in hours)
+    # within window; each one spans from end of work on one day to its start on the next
+    offset = utc_offset * 3600
+    day = (window_start + offset) // day_seconds - 1
+    intervals = []
+
+    while day * day_seconds - offset < window_end:
+        start = day * day_seconds + work_to * 3600 - offset
+        end = (day + 1) * day_seconds + work_from * 3600 - offset
+
+        if start < end and end > window_start and start < window_end:
+            intervals.append([max(start, window_start), min(end, window_end)])
+
+        day += 1
+
+    return intervals
+
+
+def find_free_slots(busy_lists, window_start, window_end, duration, limit):
+    # sweep-line over sorted interval lists of all users - k-way merge by start time keeps end of busy time covered
+    # so far, every gap of at least duration is free for everyone; stops after limit gaps found, so only the part
+    # of lists up to last returned gap is visited
+    slots = []
+    free_from = window_start
+
+    for start, end in merge(*busy_lists):
+        if start >= window_end:
+            break
+
+        if start - free_from >= duration:
+            slots.append([free_from, start])
+
+            if len(slots) == limit:
+                return slots
+
+        if end > free_from:
+            free_from = end
+
+    if window_end - free_from >= duration:
+        slots.append([free_from, window_end])
+
+    return slots
@@ -3,15 +3,87 @@
 from flask.json import JSONEncoder
 from datetime import datetime
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_datetime_format = "%04d-%02d-%02d %02d:%02d:%02d %s"
+_offset_suffixes = {None: ''}
+
+
+def _offset_suffix(offset):
+    # same as strftime %z, there are only few distinct offsets so they are formatted once
+    try:
+        return _offset_suffixes[offset]
+    except KeyError:
+        minutes = offset.days * 1440 + offset.seconds // 60
+        sign = '-' if minutes < 0 else '+'
+        suffix = _offset_suffixes[offset] = '{}{:02d}{:02d}'.format(sign, *divmod(abs(minutes), 60))
+        return suffix
+
+
+def format_datetime(d):
+    # equivalent of d.strftime("%Y-%m-%d %H:%M:%S %z") without going through strftime
+    return _datetime_format % (d.year, d.month, d.day, d.hour, d.minute, d.second, _offset_suffix(d.utcoffset()))
+
 
 class CustomJSONEncoder(JSONEncoder):
     def default(self, obj):
+        if isinstance(obj, datetime):
+            return format_datetime(obj)
+
         try:
-            if isinstance(obj, datetime):
-                return obj.strftime("%Y-%m-%d %H:%M:%S %z")
             iterable = iter(obj)
         except TypeError:
             pass
         else:
             return list(iterable)
         return JSONEncoder.default(self, obj)
+
+
+def _orjson_default(obj):
+    if isinstance(obj, datetime):
+        return format_datetime(obj)
+
+    try:
+        return list(iter(obj))
+    except TypeError:
+        raise TypeError("Object of type {} is not JSON serializable".format(type(obj).__name__))
+
+
+if orjson is not None:
+    _orjson_options = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+    def dumps(obj):
+        return orjson.dumps(obj, default=_orjson_default, option=_orjson_options).decode()
+else:
+    _encoder = CustomJSONEncoder(separators=(',', ':'))
+
+    def dumps(obj):
+        return _encoder.encode(obj)
+
+
+def iter_json_list_response(ret_json, key, batch_size=100):
+    # list under given key is consumed lazily, response has the same shape as a page; if reading fails midway,
+    # list ends there and next_cursor lets client continue after the last sent item
+    items = ret_json[key]
+    chunk = ['{"success":true,"' + key + '":[']
+    separator = ''
+
+    try:
+        for item in items:
+            chunk.append(separator + dumps(item))
+            separator = ','
+
+            if len(chunk) >= batch_size:
+                yield ''.join(chunk)
+                chunk = []
+    except Exception:
+        next_cursor = getattr(items, 'next_cursor', None)
+    else:
+        next_cursor = None
+
+    chunk.append('],"next_cursor":' + dumps(next_cursor) + '}')
+
+    yield ''.join(chunk)
@@ -0,0 +1,143 @@
+from contextlib import contextmanager
+from glob import glob
+from queue import Queue, Empty, Full
+
+import json
+import os
+import socket
+import threading
+
+from .json_encoder import dumps
+
+
+class LocalBackend:
+    # single process - messages go straight to local subscribers
+    def attach(self, deliver):
+        self._deliver = deliver
+
+    def start(self):
+        pass
+
+    def publish(self, user_ids, message):
+        self._deliver(user_ids, message)
+
+
+class UnixSocketBackend:
+    # fan-out between worker processes on one host - each process subscribing to notifications binds datagram
+    # socket in shared directory, published message is sent to all of them (including own one)
+    def __init__(self, directory, max_message_size=65536):
+        self._directory = directory
+        self._max_message_size = max_message_size
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def attach(self, deliver):
+        self._deliver = deliver
+
+    def start(self):
+        # receiver is bound per process, so it is started again in forked worker
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+
+            os.makedirs(self._directory, mode=0o700, exist_ok=True)
+
+            path = os.path.join(self._directory, '{}.sock'.format(os.getpid()))
+
+            if os.path.exists(path):
+                os.unlink(path)
+
+            receiver = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            receiver.bind(path)
+
+            threading.Thread(target=self._receive, args=(receiver,), daemon=True).start()
+
+            self._pid = os.getpid()
+
+    def _receive(self, receiver):
+        while True:
+            try:
+                message = json.loads(receiver.recv(self._max_message_size).decode())
+            except ValueError:
+                continue
+
+            self._deliver(message['user_ids'], message['message'])
+
+    def publish(self, user_ids, message):
+        payload = json.dumps({'user_ids': user_ids, 'message': message}).encode()
+        sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sender.setblocking(False)
+
+        try:
+            for path in glob(os.path.join(self._directory, '*.sock')):
+                try:
+                    sender.sendto(payload, path)
+                except (ConnectionRefusedError, FileNotFoundError):
+                    # socket left by finished process
+                    try:
+                        os.unlink(path)
+                    except FileNotFoundError:
+                        pass
+                except OSError:
+                    # receiver queue full, notifications are best effort
+                    pass
+        finally:
+            sender.close()
+
+
+class NotificationHub:
+    def __init__(self, backend=None, queue_size=100):
+        self._backend = backend if backend is not None else LocalBackend()
+        self._queue_size = queue_size
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+        self._backend.attach(self._deliver)
+
+    @contextmanager
+    def subscribe(self, user_id):
+        queue = Queue(self._queue_size)
+
+        with self._lock:
+            self._subscribers.setdefault(user_id, set()).add(queue)
+
+        try:
+            self._backend.start()
+
+            yield queue
+        finally:
+            with self._lock:
+                queues = self._subscribers[user_id]
+                queues.discard(queue)
+
+                if not queues:
+                    del self._subscribers[user_id]
+
+    def publish(self, user_ids, event, data):
+        if user_ids:
+            self._backend.publish(list(user_ids), {'event': event, 'data': data})
+
+    def _deliver(self, user_ids, message):
+        with self._lock:
+            queues = [queue for user_id in user_ids for queue in self._subscribers.get(user_id, ())]
+
+        for queue in queues:
+            try:
+                queue.put_nowait(message)
+            except Full:
+                # slow client misses notifications rather than blocking publishers
+                pass
+
+
+def iter_event_stream(subscription, heartbeat_interval):
+    # server-sent events, comment lines keep idle connection open through proxies
+    with subscription as queue:
+        yield ': connected\n\n'
+
+        while True:
+            try:
+                message = queue.get(timeout=heartbeat_interval)
+            except Empty:
+                yield ': heartbeat\n\n'
+            else:
+                yield 'event: {}\ndata: {}\n\n'.format(message['event'], dumps(message['data']))
@@ -0,0 +1,90 @@
+from calendar import monthrange
+from datetime import MAXYEAR, timedelta
+
+from .var_utils import get_timezone
+
+frequencies = ('daily', 'weekly', 'monthly')
+
+
+def _step(frequency, interval):
+    return timedelta(days=interval * 7 if frequency == 'weekly' else interval)
+
+
+def _fixed_step_starts(start_time, end_time, step, from_time, not_before):
+    # occurrences before window are skipped arithmetically, not generated
+    index = 0
+
+    if from_time is not None and end_time <= from_time:
+        index = (from_time - end_time) // step + 1
+
+    if not_before is not None and start_time < not_before:
+        index = max(index, -((start_time - not_before) // step))
+
+    try:
+        while True:
+            yield index, start_time + index * step
+            index += 1
+    except OverflowError:
+        return
+
+
+def _monthly_starts(start_time, event_timezone, interval):
+    # day of month is taken in event timezone, months without it are skipped (as in RFC 5545), so such
+    # occurrences are not counted either
+    local_start = start_time.astimezone(get_timezone(event_timezone))
+    month = local_start.year * 12 + local_start.month - 1
+    index = 0
+
+    while month // 12 <= MAXYEAR:
+        year, month_of_year = divmod(month, 12)
+
+        if local_start.day <= monthrange(year, month_of_year + 1)[1]:
+            yield index, local_start.replace(year=year, month=month_of_year + 1).astimezone(start_time.tzinfo)
+            index += 1
+
+        month += interval
+
+
+def occurrences(start_time, end_time, event_timezone, frequency, interval=1, count=None, until=None, exceptions=(),
+                from_time=None, to_time=None, not_before=None):
+    # lazily yields (start, end) of series occurrences overlapping window from_time - to_time and starting at
+    # not_before or later; first occurrence is the event itself, following ones keep its duration, and as
+    # timezones are fixed offsets, all-day occurrences start at midnight of event timezone just as the first one
+    duration = end_time - start_time
+
+    if frequency == 'monthly':
+        starts = _monthly_starts(start_time, event_timezone, interval)
+    else:
+        starts = _fixed_step_starts(start_time, end_time, _step(frequency, interval), from_time, not_before)
+
+    for index, occurrence_start in starts:
+        if count is not None and index >= count or until is not None and occurrence_start > until or \
+                to_time is not None and occurrence_start >= to_time:
+            return
+
+        if occurrence_start in exceptions or from_time is not None and occurrence_start + duration <= from_time or \
+                not_before is not None and occurrence_start < not_before:
+            continue
+
+        yield occurrence_start, occurrence_start + duration
+
+
+def series_end(start_time, end_time, event_timezone, frequency, interval=1, count=None, until=None):
+    # end of last occurrence, None for series without end
+    if count is None and until is None:
+        return None
+
+    if frequency != 'monthly':
+        step = _step(frequency, interval)
+        last_index = min(index for index in (None if count is None else count - 1,
+                                             None if until is None else (until - start_time) // step)
+                         if index is not None)
+
+        return end_time + max(last_index, 0) * step
+
+    last_end = end_time
+
+    for _, last_end in occurrences(start_time, end_time, event_timezone, frequency, interval, count, until):
+        pass
+
+    return last_end
@@ -0,0 +1,58 @@
+from bisect import bisect_left, insort
+from time import monotonic
+
+import threading
+
+
+class UsernameIndex:
+    def __init__(self, refresh_interval):
+        self._refresh_interval = refresh_interval
+        self._entries = []
+        self._user_ids = set()
+        self._version = None
+        self._last_refresh = None
+        self._lock = threading.Lock()
+
+    def needs_refresh(self):
+        return self._last_refresh is None or monotonic() - self._last_refresh > self._refresh_interval
+
+    @property
+    def version(self):
+        return self._version
+
+    def reload(self, users, version):
+        # whole index is replaced, so users committed out of id order, renamed or removed are picked up too
+        entries = sorted((username.lower(), username, user_id) for user_id, username in users)
+
+        with self._lock:
+            self._entries = entries
+            self._user_ids = {user_id for _, _, user_id in entries}
+            self._version = version
+            self._last_refresh = monotonic()
+
+    def mark_refreshed(self):
+        with self._lock:
+            self._last_refresh = monotonic()
+
+    def add_user(self, user_id, username):
+        with self._lock:
+            self._insert(user_id, username)
+
+    def _insert(self, user_id, username):
+        if user_id not in self._user_ids:
+            self._user_ids.add(user_id)
+            insort(self._entries, (username.lower(), username, user_id))
+
+    def prefix(self, prefix, limit):
+        prefix = prefix.lower()
+        users = []
+
+        with self._lock:
+            position = bisect_left(self._entries, (prefix,))
+
+            while position < len(self._entries) and len(users) < limit and \
+                    self._entries[position][0].startswith(prefix):
+                users.append({"user_id": self._entries[position][2], "username": self._entries[position][1]})
+                position += 1
+
+        return users
@@ -1,13 +1,79 @@
 import hashlib
 
-from datetime import timezone, timedelta
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from binascii import Error as DecodeError
+from calendar import timegm
+from collections import OrderedDict
+from datetime import datetime, timezone, timedelta
 
 from .config import salt_1, salt_2
 
+_timezones = {hours: timezone(timedelta(hours=hours)) for hours in range(-12, 15)}
+
 
 def get_password_hash(password):
     return hashlib.sha256((salt_1 + password + salt_2).encode()).hexdigest()
 
 
+def get_timezone(hours):
+    try:
+        return _timezones[hours]
+    except KeyError:
+        return timezone(timedelta(hours=hours))
+
+
 def set_utc(d):
-    return d.replace(tzinfo=timezone(timedelta(hours=0)))
+    return d.replace(tzinfo=_timezones[0])
+
+
+def utc_today():
+    # start of current UTC day
+    return set_utc(datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0))
+
+
+def epoch_seconds(d):
+    # naive datetimes are stored as UTC
+    return timegm(d.utctimetuple())
+
+
+def encode_cursor(start_time, event_id):
+    start_time = start_time.astimezone(_timezones[0])
+
+    return urlsafe_b64encode("{}:{}".format(start_time.strftime("%Y%m%d%H%M%S"), event_id).encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        start_time, event_id = urlsafe_b64decode(cursor.encode()).decode().split(':')
+    except (DecodeError, UnicodeError, ValueError):
+        raise ValueError("Malformed cursor.")
+
+    return set_utc(datetime.strptime(start_time, "%Y%m%d%H%M%S")), int(event_id)
+
+
+class LRUCache:
+    def __init__(self, max_size):
+        self._max_size = max_size
+        self._entries = OrderedDict()
+
+    def get(self, key, default=None):
+        try:
+            self._entries.move_to_end(key)
+        except KeyError:
+            return default
+
+        return self._entries[key]
+
+    def put(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+
+        if len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, predicate):
+        for key in [k for k in self._entries if predicate(k)]:
+            del self._entries[key]
+
+    def clear(self):
+        self._entries.clear()
@@ -0,0 +1,6 @@
+# usage: python compact_changes.py, periodically (e.g. daily from cron)
+
+from calendar_app.calendar import calendar_app
+
+if __name__ == '__main__':
+    print(calendar_app.compact_changes())
@@ -0,0 +1,95 @@
+from calendar_app.date_parser import parse_datetime, parse_datetimes
+from datetime import datetime
+
+import random
+
+
+def strptime_or_error(value, with_offset):
+    try:
+        return datetime.strptime(value, "%Y-%m-%d %H:%M:%S %z" if with_offset else "%Y-%m-%d %H:%M:%S")
+    except (ValueError, TypeError) as e:
+        return type(e)
+
+
+def parse_or_error(value, with_offset):
+    try:
+        return parse_datetime(value, with_offset)
+    except (ValueError, TypeError) as e:
+        return type(e)
+
+
+def same_result(value, with_offset):
+    expected, result = strptime_or_error(value, with_offset), parse_or_error(value, with_offset)
+
+    if isinstance(expected, datetime):
+        return isinstance(result, datetime) and expected == result and expected.tzinfo == result.tzinfo and \
+               expected.replace(tzinfo=None) == result.replace(tzinfo=None)
+
+    return expected == result
+
+
+def mutations(value, count):
+    alphabet = "0123456789 -+:Z\t١²x"
+
+    for _ in range(count):
+        chars = list(value)
+        operation = random.randint(0, 2)
+        position = random.randint(0, len(chars) - 1)
+
+        if operation == 0:
+            chars[position] = random.choice(alphabet)
+        elif operation == 1:
+            del chars[position]
+        else:
+            chars.insert(position, random.choice(alphabet))
+
+        yield ''.join(chars)
+
+
+def test_edge_cases():
+    cases = ["2017-05-01 10:20:30", "2017-5-1 10:20:30", "2017-05-01  10:20:30", "2017-05-01 1:2:3",
+             "2017-02-29 10:20:30", "2016-02-29 10:20:30", "2017-13-01 10:20:30", "2017-00-01 10:20:30",
+             "2017-05-00 10:20:30", "2017-05-32 10:20:30", "2017-05-01 24:00:00", "2017-05-01 23:60:00",
+             "2017-05-01 23:59:60", "2017-05-01 23:59:61", "0000-05-01 10:20:30", "9999-12-31 23:59:59",
+             "2017-05-01 10:20:30 +0200", "2017-05-01 10:20:30 -0200", "2017-05-01 10:20:30 +0000",
+             "2017-05-01 10:20:30 -0000", "2017-05-01 10:20:30 +1400", "2017-05-01 10:20:30 +0530",
+             "2017-05-01 10:20:30 +0560", "2017-05-01 10:20:30 +2400", "2017-05-01 10:20:30 +2359",
+             "2017-05-01 10:20:30 +02:00", "2017-05-01 10:20:30 Z", "2017-05-01 10:20:30 +020000",
+             "٢٠١٧-05-01 10:20:30", "2017-05-01 10:20:²30", "2017-05-01T10:20:30",
+             "2017-05-01 10:20:30 ", " 2017-05-01 10:20:30", "2017-05- 1 10:20:30", "", None, 20170501]
+
+    for case in cases:
+        for with_offset in (False, True):
+            assert same_result(case, with_offset), (case, with_offset)
+
+
+def test_random_mutations():
+    random.seed(0)
+
+    for _ in range(200):
+        value = datetime(random.randint(1, 9999), random.randint(1, 12), random.randint(1, 28), random.randint(0, 23),
+                         random.randint(0, 59), random.randint(0, 59))
+        offset = "{}{:02d}{:02d}".format(random.choice('+-'), random.randint(0, 25), random.choice([0, 30, 45, 60]))
+
+        for with_offset, text in ((False, value.strftime("%Y-%m-%d %H:%M:%S")),
+                                  (True, value.strftime("%Y-%m-%d %H:%M:%S ") + offset)):
+            assert same_result(text, with_offset), (text, with_offset)
+
+            for mutated in mutations(text, 50):
+                for mutated_offset in (False, True):
+                    assert same_result(mutated, mutated_offset), (mutated, mutated_offset)
+
+
+def test_batch():
+    values = ["2017-05-01 10:20:30", "2018-02-30 00:00:00", "2018-01-31 00:00:00", None]
+
+    assert parse_datetimes(values) == [datetime(2017, 5, 1, 10, 20, 30), None, datetime(2018, 1, 31), None]
+    assert parse_datetimes(["2017-05-01 10:20:30 +0200"], True) == [parse_datetime("2017-05-01 10:20:30 +0200", True)]
+
+
+if __name__ == '__main__':
+    test_edge_cases()
+    test_random_mutations()
+    test_batch()
+
+    print("OK")
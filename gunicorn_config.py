@@ -0,0 +1,30 @@
+# usage: gunicorn -c gunicorn_config.py wsgi:app
+
+import multiprocessing
+
+from calendar_app.config import workers as configured_workers, db_max_connections, pool_size, worker_threads, \
+    pool_max_overflow, notifications_heartbeat
+
+bind = "0.0.0.0:5000"
+workers = configured_workers or multiprocessing.cpu_count() * 2 + 1
+preload_app = True
+
+# threaded workers, so open /notifications streams do not take whole processes; worker timeout is checked by its
+# main loop, not by request duration, and heartbeats of streams are sent well before it or proxy timeouts
+worker_class = 'gthread'
+threads = worker_threads
+timeout = max(30, notifications_heartbeat * 2)
+keepalive = 5
+
+
+def post_fork(server, worker):
+    from server_api import calendar_app
+
+    if db_max_connections:
+        # pool and its overflow of all workers together stay within db_max_connections
+        budget = max(1, db_max_connections // workers)
+        worker_pool_size = min(pool_size, budget)
+
+        calendar_app.reset_after_fork(worker_pool_size, min(pool_max_overflow, budget - worker_pool_size))
+    else:
+        calendar_app.reset_after_fork(pool_size, pool_max_overflow)
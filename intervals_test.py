@@ -0,0 +1,130 @@
+from calendar_app.intervals import merge_intervals, clip_intervals, off_hours, find_free_slots
+
+import random
+import time
+
+
+def naive_busy_points(intervals):
+    return {point for start, end in intervals for point in range(start, end)}
+
+
+def test_merge_edge_cases():
+    assert merge_intervals([]) == []
+    assert merge_intervals([(5, 10)]) == [[5, 10]]
+    assert merge_intervals([(5, 10), (1, 3)]) == [[1, 3], [5, 10]]
+    assert merge_intervals([(1, 5), (5, 8)]) == [[1, 8]]
+    assert merge_intervals([(1, 10), (2, 3), (4, 12)]) == [[1, 12]]
+    assert merge_intervals([(1, 3), (1, 3)]) == [[1, 3]]
+
+
+def test_merge_random():
+    random.seed(23)
+
+    for _ in range(500):
+        intervals = []
+
+        for _ in range(random.randint(0, 30)):
+            start = random.randint(0, 200)
+            intervals.append((start, start + random.randint(1, 30)))
+
+        merged = merge_intervals(intervals)
+
+        assert naive_busy_points(intervals) == naive_busy_points(merged)
+        assert all(merged[i][1] < merged[i + 1][0] for i in range(len(merged) - 1))
+
+
+def test_clip():
+    assert clip_intervals([[0, 5], [8, 12], [20, 30]], 3, 10) == [[3, 5], [8, 10]]
+    assert clip_intervals([[0, 5]], 5, 10) == []
+
+
+def test_off_hours():
+    # 2030-01-10 00:00:00 UTC, working hours 9-17 at UTC+2 are 7-15 UTC
+    day = 1894233600
+    hour = 3600
+
+    assert off_hours(day, day + 24 * hour, 9, 17, 2) == [[day, day + 7 * hour], [day + 15 * hour, day + 24 * hour]]
+    assert off_hours(day + 8 * hour, day + 14 * hour, 9, 17, 2) == []
+    assert off_hours(day, day + 48 * hour, 0, 24, -5) == []
+    assert off_hours(day + 20 * hour, day + 34 * hour, 9, 17, 0) == [[day + 20 * hour, day + 33 * hour]]
+
+
+def naive_free_slots(busy_lists, window_start, window_end, duration, limit):
+    busy = naive_busy_points(interval for busy_list in busy_lists for interval in busy_list)
+    slots = []
+    slot_start = None
+
+    for point in range(window_start, window_end + 1):
+        if point < window_end and point not in busy:
+            if slot_start is None:
+                slot_start = point
+        elif slot_start is not None:
+            if point - slot_start >= duration:
+                slots.append([slot_start, point])
+
+            slot_start = None
+
+    return slots[:limit]
+
+
+def test_find_free_slots_random():
+    random.seed(24)
+
+    for _ in range(300):
+        window_start = random.randint(0, 50)
+        window_end = window_start + random.randint(0, 200)
+        busy_lists = []
+
+        for _ in range(random.randint(0, 6)):
+            intervals = []
+
+            for _ in range(random.randint(0, 8)):
+                start = random.randint(0, 250)
+                intervals.append((start, start + random.randint(1, 30)))
+
+            busy_lists.append(clip_intervals(merge_intervals(intervals), window_start, window_end))
+
+        duration, limit = random.randint(1, 20), random.randint(1, 5)
+
+        assert find_free_slots(busy_lists, window_start, window_end, duration, limit) == \
+            naive_free_slots(busy_lists, window_start, window_end, duration, limit)
+
+
+def benchmark_find_free_slots(users=100, days=31, events_per_day=6):
+    # 100 users with a month of half-hour to two hour meetings between 8 and 18 UTC, users spread over 3 timezones;
+    # slots of one hour within 9-17 working hours of everyone - such busy calendars leave (almost) no common slot,
+    # so all intervals of the month are swept, which is the worst case
+    random.seed(0)
+    window_start, window_end = 1894233600, 1894233600 + days * 24 * 3600
+    user_intervals = []
+
+    for _ in range(users):
+        intervals = []
+
+        for day in range(days):
+            for _ in range(events_per_day):
+                start = window_start + day * 24 * 3600 + random.randint(8 * 4, 18 * 4) * 900
+                intervals.append((start, start + random.randint(2, 8) * 900))
+
+        user_intervals.append(intervals)
+
+    started = time.perf_counter()
+
+    busy_lists = [clip_intervals(merge_intervals(intervals), window_start, window_end) for intervals in user_intervals]
+    busy_lists.extend(off_hours(window_start, window_end, 9, 17, utc_offset) for utc_offset in range(-1, 2))
+    slots = find_free_slots(busy_lists, window_start, window_end, 3600, 10 ** 6)
+
+    print("{} users, {} days, {} busy intervals: {} slots in {:.1f} ms".format(
+        users, days, sum(map(len, busy_lists)), len(slots), (time.perf_counter() - started) * 1000))
+
+
+if __name__ == '__main__':
+    test_merge_edge_cases()
+    test_merge_random()
+    test_clip()
+    test_off_hours()
+    test_find_free_slots_random()
+
+    print("OK")
+
+    benchmark_find_free_slots()
@@ -0,0 +1,62 @@
+from calendar_app.recurrence import occurrences, series_end
+from calendar_app.var_utils import get_timezone
+from datetime import datetime, timedelta
+
+import random
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=get_timezone(0))
+
+
+def test_monthly_keeps_local_day():
+    # 2030-01-31 00:30 at UTC+2 is 2030-01-30 22:30 UTC, months without 31st are skipped
+    start = utc(2030, 1, 30, 22, 30)
+    starts = [s for s, e in occurrences(start, start + timedelta(hours=1), 2, 'monthly', count=4)]
+
+    assert starts == [utc(2030, 1, 30, 22, 30), utc(2030, 3, 30, 22, 30), utc(2030, 5, 30, 22, 30),
+                      utc(2030, 7, 30, 22, 30)]
+    assert series_end(start, start + timedelta(hours=1), 2, 'monthly', count=4) == utc(2030, 7, 30, 23, 30)
+
+
+def test_count_until_and_exceptions():
+    start = utc(2030, 1, 7, 8)
+    end = start + timedelta(hours=1)
+
+    assert len(list(occurrences(start, end, 0, 'weekly', count=5))) == 5
+    assert len(list(occurrences(start, end, 0, 'weekly', 2, until=utc(2030, 2, 4, 8)))) == 3
+    assert [s for s, e in occurrences(start, end, 0, 'daily', count=3, exceptions={utc(2030, 1, 8, 8)})] == \
+        [utc(2030, 1, 7, 8), utc(2030, 1, 9, 8)]
+    assert series_end(start, end, 0, 'weekly', 2, until=utc(2030, 2, 4, 8)) == utc(2030, 2, 4, 9)
+    assert series_end(start, end, 0, 'daily') is None
+
+
+def test_window_matches_full_expansion():
+    random.seed(25)
+
+    for _ in range(300):
+        start = utc(2030, 1, 1) + timedelta(minutes=random.randint(0, 60 * 24 * 60))
+        end = start + timedelta(minutes=random.randint(0, 60 * 30))
+        event_timezone = random.randint(-12, 14)
+        frequency = random.choice(('daily', 'weekly', 'monthly'))
+        interval, count = random.randint(1, 3), random.randint(1, 40)
+
+        from_time = utc(2030, 1, 1) + timedelta(hours=random.randint(0, 24 * 400))
+        to_time = from_time + timedelta(hours=random.randint(0, 24 * 60))
+        not_before = from_time + timedelta(hours=random.randint(-48, 48))
+
+        everything = list(occurrences(start, end, event_timezone, frequency, interval, count))
+        expected = [(s, e) for s, e in everything if e > from_time and s < to_time and s >= not_before]
+
+        assert len(everything) == count
+        assert list(occurrences(start, end, event_timezone, frequency, interval, count, from_time=from_time,
+                                to_time=to_time, not_before=not_before)) == expected
+        assert series_end(start, end, event_timezone, frequency, interval, count) == everything[-1][1]
+
+
+if __name__ == '__main__':
+    test_monthly_keeps_local_day()
+    test_count_until_and_exceptions()
+    test_window_matches_full_expansion()
+
+    print("OK")
@@ -1,12 +1,64 @@
-from flask import Flask, jsonify, request, session
+from flask import Flask, Response, request, session, stream_with_context
+from functools import partial
 
 from calendar_app.calendar import calendar_app
-from calendar_app.json_encoder import CustomJSONEncoder
+from calendar_app.config import secret_key, notifications_heartbeat
+from calendar_app.json_encoder import CustomJSONEncoder, dumps, iter_json_list_response
+from calendar_app.notifications import iter_event_stream
 
 app = Flask(__name__)
 app.json_encoder = CustomJSONEncoder
 
 
+@app.before_request
+def begin_request():
+    calendar_app.begin_request()
+
+
+@app.after_request
+def commit_request(response):
+    # responses of unhandled errors are not committed
+    if response.status_code >= 500:
+        return response
+
+    error = calendar_app.commit_request()
+
+    return response if error is None else json_response(error)
+
+
+@app.teardown_request
+def end_request(error=None):
+    calendar_app.end_request()
+
+
+def json_response(ret_json):
+    return Response(dumps(ret_json), mimetype='application/json')
+
+
+def json_list_response(ret_json, key):
+    if ret_json['success'] and not isinstance(ret_json[key], list):
+        return Response(stream_with_context(iter_json_list_response(ret_json, key)), mimetype='application/json')
+
+    return json_response(ret_json)
+
+
+def versioned_json_response(ret_json, key=None):
+    etag = ret_json.pop('etag', None)
+
+    if ret_json.pop('not_modified', False):
+        response = Response(status=304)
+    elif key is not None:
+        response = json_list_response(ret_json, key)
+    else:
+        response = json_response(ret_json)
+
+    if etag is not None:
+        response.set_etag(etag, weak=True)
+        response.headers['Cache-Control'] = 'private, no-cache'
+
+    return response
+
+
 @app.route("/user", methods=['PUT'])
 def create_user():
     if session.get('user_id', None) is not None:
@@ -28,7 +80,7 @@ def create_user():
             except Exception:
                 ret_json = calendar_app.error_dict(5, "Server error.")
 
-    return jsonify(ret_json)
+    return json_response(ret_json)
 
 
 @app.route("/users/<string:like>", methods=['GET'])
@@ -37,11 +89,12 @@ def get_users_like(like):
         ret_json = calendar_app.error_dict(1, "Need to log in before performing any action.")
     else:
         try:
-            ret_json = calendar_app.get_users(like)
+            ret_json = calendar_app.get_users(like, request.args.get('prefix', 0, int) == 1,
+                                              request.args.get('limit', None, int))
         except Exception:
             ret_json = calendar_app.error_dict(5, "Server error.")
 
-    return jsonify(ret_json)
+    return json_response(ret_json)
 
 
 @app.route("/auth", methods=['POST'])
@@ -67,7 +120,7 @@ def auth_user():
             except Exception:
                 ret_json = calendar_app.error_dict(5, "Server error.")
 
-    return jsonify(ret_json)
+    return json_response(ret_json)
 
 
 @app.route("/logout", methods=['POST'])
@@ -80,7 +133,7 @@ def logout_user():
 
         ret_json = calendar_app.success_dict('logout', True)
 
-    return jsonify(ret_json)
+    return json_response(ret_json)
 
 
 @app.route("/calendar", methods=['PUT'])
@@ -98,7 +151,7 @@ def create_calendar():
         except Exception:
             ret_json = calendar_app.error_dict(5, "Server error.")
 
-    return jsonify(ret_json)
+    return json_response(ret_json)
 
 
 @app.route("/calendar/<int:calendar_id>", methods=['GET'])
@@ -107,11 +160,84 @@ def get_calendar_events(calendar_id):
         ret_json = calendar_app.error_dict(1, "Need to log in before performing any action.")
     else:
         try:
-            ret_json = calendar_app.get_events(session['user_id'], session['user_tz'], calendar_id)
+            ret_json = calendar_app.get_events(session['user_id'], session['user_tz'], calendar_id,
+                                               request.args.get('from', None), request.args.get('to', None),
+                                               request.args.get('limit', None, int), request.args.get('cursor', None),
+                                               request.args.get('stream', 0, int) == 1,
+                                               request.args.get('fields', None),
+                                               request.args.get('compact', 0, int) == 1,
+                                               request.if_none_match.as_set(True))
         except Exception:
             ret_json = calendar_app.error_dict(5, "Server error.")
 
-    return jsonify(ret_json)
+    return versioned_json_response(ret_json, 'events')
+
+
+@app.route("/agenda", methods=['GET'])
+def get_agenda():
+    if session.get('user_id', None) is None:
+        ret_json = calendar_app.error_dict(1, "Need to log in before performing any action.")
+    else:
+        try:
+            ret_json = calendar_app.get_agenda(session['user_id'], session['user_tz'], request.args.get('from', None),
+                                               request.args.get('to', None), request.args.get('limit', None, int),
+                                               request.args.get('cursor', None),
+                                               request.args.get('stream', 0, int) == 1,
+                                               request.args.get('fields', None),
+                                               request.args.get('compact', 0, int) == 1)
+        except Exception:
+            ret_json = calendar_app.error_dict(5, "Server error.")
+
+    return json_list_response(ret_json, 'events')
+
+
+@app.route("/freebusy", methods=['GET'])
+def get_free_busy():
+    if session.get('user_id', None) is None:
+        ret_json = calendar_app.error_dict(1, "Need to log in before performing any action.")
+    else:
+        try:
+            ret_json = calendar_app.get_free_busy(session['user_id'], session['user_tz'],
+                                                  request.args.getlist('user_id', int), request.args.get('from', None),
+                                                  request.args.get('to', None))
+        except Exception:
+            ret_json = calendar_app.error_dict(5, "Server error.")
+
+    return json_response(ret_json)
+
+
+@app.route("/freebusy/slots", methods=['GET'])
+def find_meeting_slots():
+    if session.get('user_id', None) is None:
+        ret_json = calendar_app.error_dict(1, "Need to log in before performing any action.")
+    else:
+        try:
+            ret_json = calendar_app.find_meeting_slots(session['user_id'], session['user_tz'],
+                                                       request.args.getlist('user_id', int),
+                                                       request.args.get('duration', None, int),
+                                                       request.args.get('from', None), request.args.get('to', None),
+                                                       request.args.get('work_from', None, int),
+                                                       request.args.get('work_to', None, int),
+                                                       request.args.get('limit', None, int))
+        except Exception:
+            ret_json = calendar_app.error_dict(5, "Server error.")
+
+    return json_response(ret_json)
+
+
+@app.route("/calendar/<int:calendar_id>/changes", methods=['GET'])
+def get_calendar_changes(calendar_id):
+    if session.get('user_id', None) is None:
+        ret_json = calendar_app.error_dict(1, "Need to log in before performing any action.")
+    else:
+        try:
+            ret_json = calendar_app.get_changes(session['user_id'], session['user_tz'], calendar_id,
+                                                request.args.get('since', None, int), request.args.get('fields', None),
+                                                request.args.get('compact', 0, int) == 1)
+        except Exception:
+            ret_json = calendar_app.error_dict(5, "Server error.")
+
+    return json_response(ret_json)
 
 
 @app.route("/calendar/<int:calendar_id>", methods=['POST', 'DELETE'])
@@ -132,7 +258,7 @@ def edit_delete_calendar(calendar_id):
         except Exception:
             ret_json = calendar_app.error_dict(5, "Server error.")
 
-    return jsonify(ret_json)
+    return json_response(ret_json)
 
 
 @app.route("/calendar/<int:calendar_id>/share", methods=['PUT'])
@@ -150,7 +276,7 @@ def share_calendar(calendar_id):
         except Exception:
             ret_json = calendar_app.error_dict(5, "Server error.")
 
-    return jsonify(ret_json)
+    return json_response(ret_json)
 
 
 @app.route("/calendars", methods=['GET'])
@@ -159,11 +285,11 @@ def get_calendars():
         ret_json = calendar_app.error_dict(1, "Need to log in before performing any action.")
     else:
         try:
-            ret_json = calendar_app.get_calendars(session['user_id'])
+            ret_json = calendar_app.get_calendars(session['user_id'], request.if_none_match.as_set(True))
         except Exception:
             ret_json = calendar_app.error_dict(5, "Server error.")
 
-    return jsonify(ret_json)
+    return versioned_json_response(ret_json)
 
 
 @app.route("/shares", methods=['GET'])
@@ -176,7 +302,7 @@ def get_shares():
         except Exception:
             ret_json = calendar_app.error_dict(5, "Server error.")
 
-    return jsonify(ret_json)
+    return json_response(ret_json)
 
 
 @app.route("/share/<int:share_id>", methods=['POST', 'DELETE'])
@@ -196,7 +322,7 @@ def edit_delete_share(share_id):
         except Exception:
             ret_json = calendar_app.error_dict(5, "Server error.")
 
-    return jsonify(ret_json)
+    return json_response(ret_json)
 
 
 @app.route("/calendar/<int:calendar_id>/event", methods=['PUT'])
@@ -210,13 +336,30 @@ def create_event(calendar_id):
             ret_json = calendar_app.add_event(session['user_id'], calendar_id, in_data['event_name'],
                                               in_data['event_description'], in_data['start_time'],
                                               in_data['end_time'], in_data.get('event_timezone', None),
-                                              in_data['all_day_event'])
+                                              in_data['all_day_event'], in_data.get('recurrence', None))
         except (KeyError, TypeError) as e:
             ret_json = calendar_app.error_dict(4, "Request malformed. Missing data.")
         except Exception:
             ret_json = calendar_app.error_dict(5, "Server error.")
 
-    return jsonify(ret_json)
+    return json_response(ret_json)
+
+
+@app.route("/calendar/<int:calendar_id>/events", methods=['PUT'])
+def create_events(calendar_id):
+    if session.get('user_id', None) is None:
+        ret_json = calendar_app.error_dict(1, "Need to log in before performing any action.")
+    else:
+        try:
+            in_data = request.get_json()
+
+            ret_json = calendar_app.add_events(session['user_id'], calendar_id, list(in_data['events']))
+        except (KeyError, TypeError):
+            ret_json = calendar_app.error_dict(4, "Request malformed. Missing data.")
+        except Exception:
+            ret_json = calendar_app.error_dict(5, "Server error.")
+
+    return json_response(ret_json)
 
 
 @app.route("/event/<int:event_id>", methods=['GET', 'POST', 'DELETE'])
@@ -235,13 +378,51 @@ def get_edit_delete_event(event_id):
             elif request.method == 'DELETE':
                 ret_json = calendar_app.delete_event(session['user_id'], event_id)
             elif request.method == 'GET':
-                ret_json = calendar_app.get_event(session['user_id'], session['user_tz'], event_id)
+                ret_json = calendar_app.get_event(session['user_id'], session['user_tz'], event_id,
+                                                  request.args.get('fields', None),
+                                                  request.args.get('compact', 0, int) == 1)
+        except (KeyError, TypeError):
+            ret_json = calendar_app.error_dict(4, "Request malformed. Missing data.")
+        except Exception:
+            ret_json = calendar_app.error_dict(5, "Server error.")
+
+    return json_response(ret_json)
+
+
+@app.route("/event/<int:event_id>/recurrence", methods=['PUT', 'DELETE'])
+def set_delete_event_recurrence(event_id):
+    if session.get('user_id', None) is None:
+        ret_json = calendar_app.error_dict(1, "Need to log in before performing any action.")
+    else:
+        try:
+            if request.method == 'PUT':
+                ret_json = calendar_app.set_event_recurrence(session['user_id'], event_id, request.get_json())
+            else:
+                ret_json = calendar_app.delete_event_recurrence(session['user_id'], event_id)
         except (KeyError, TypeError):
             ret_json = calendar_app.error_dict(4, "Request malformed. Missing data.")
         except Exception:
             ret_json = calendar_app.error_dict(5, "Server error.")
 
-    return jsonify(ret_json)
+    return json_response(ret_json)
+
+
+@app.route("/event/<int:event_id>/recurrence/exception", methods=['PUT'])
+def add_event_recurrence_exception(event_id):
+    if session.get('user_id', None) is None:
+        ret_json = calendar_app.error_dict(1, "Need to log in before performing any action.")
+    else:
+        try:
+            in_data = request.get_json()
+
+            ret_json = calendar_app.add_recurrence_exception(session['user_id'], event_id,
+                                                             in_data['occurrence_start'])
+        except (KeyError, TypeError):
+            ret_json = calendar_app.error_dict(4, "Request malformed. Missing data.")
+        except Exception:
+            ret_json = calendar_app.error_dict(5, "Server error.")
+
+    return json_response(ret_json)
 
 
 @app.route("/event/<int:event_id>/invite", methods=['PUT'])
@@ -252,13 +433,16 @@ def invite_for_event(event_id):
         try:
             in_data = request.get_json()
 
-            ret_json = calendar_app.invite_user(session['user_id'], event_id, in_data['user_id'], False)
+            if 'user_ids' in in_data:
+                ret_json = calendar_app.invite_users(session['user_id'], event_id, list(in_data['user_ids']))
+            else:
+                ret_json = calendar_app.invite_user(session['user_id'], event_id, in_data['user_id'], False)
         except (KeyError, TypeError):
             ret_json = calendar_app.error_dict(4, "Request malformed. Missing data.")
         except Exception:
             ret_json = calendar_app.error_dict(5, "Server error.")
 
-    return jsonify(ret_json)
+    return json_response(ret_json)
 
 
 @app.route("/event/<int:event_id>/guests", methods=['GET'])
@@ -271,7 +455,20 @@ def get_event_guests(event_id):
         except Exception:
             ret_json = calendar_app.error_dict(5, "Server error.")
 
-    return jsonify(ret_json)
+    return json_response(ret_json)
+
+
+@app.route("/events/guests", methods=['GET'])
+def get_events_guests():
+    if session.get('user_id', None) is None:
+        ret_json = calendar_app.error_dict(1, "Need to log in before performing any action.")
+    else:
+        try:
+            ret_json = calendar_app.get_guests_for_events(session['user_id'], request.args.getlist('event_id', int))
+        except Exception:
+            ret_json = calendar_app.error_dict(5, "Server error.")
+
+    return json_response(ret_json)
 
 
 @app.route("/invite/<int:invite_id>/restore", methods=['POST'])
@@ -284,7 +481,7 @@ def restore_invite_data(invite_id):
         except Exception:
             ret_json = calendar_app.error_dict(5, "Server error.")
 
-    return jsonify(ret_json)
+    return json_response(ret_json)
 
 
 @app.route("/invite/<int:invite_id>/attendance", methods=['POST'])
@@ -301,7 +498,7 @@ def change_attendance_for_invite(invite_id):
         except Exception:
             ret_json = calendar_app.error_dict(5, "Server error.")
 
-    return jsonify(ret_json)
+    return json_response(ret_json)
 
 
 @app.route("/invite/<int:invite_id>", methods=['POST', 'GET'])
@@ -319,13 +516,15 @@ def edit_invite(invite_id):
                                                     in_data.get('event_timezone', None),
                                                     in_data.get('all_day_event', None))
             elif request.method == 'GET':
-                ret_json = calendar_app.get_invite(session['user_id'], session['user_tz'], invite_id)
+                ret_json = calendar_app.get_invite(session['user_id'], session['user_tz'], invite_id,
+                                                   request.args.get('fields', None),
+                                                   request.args.get('compact', 0, int) == 1)
         except (KeyError, TypeError):
             ret_json = calendar_app.error_dict(4, "Request malformed. Missing data.")
         except Exception:
             ret_json = calendar_app.error_dict(5, "Server error.")
 
-    return jsonify(ret_json)
+    return json_response(ret_json)
 
 
 @app.route("/invites", defaults={'archive': 0}, methods=['GET'])
@@ -335,13 +534,96 @@ def get_invites(archive):
         ret_json = calendar_app.error_dict(1, "Need to log in before performing any action.")
     else:
         try:
-            ret_json = calendar_app.get_invites(session['user_id'], session['user_tz'], archive)
+            ret_json = calendar_app.get_invites(session['user_id'], session['user_tz'], archive,
+                                                request.args.get('limit', None, int), request.args.get('cursor', None),
+                                                request.args.get('stream', 0, int) == 1,
+                                                request.args.get('fields', None),
+                                                request.args.get('compact', 0, int) == 1,
+                                                request.if_none_match.as_set(True))
         except Exception:
             ret_json = calendar_app.error_dict(5, "Server error.")
 
-    return jsonify(ret_json)
+    return versioned_json_response(ret_json, 'invites')
+
+
+# operations allowed in /batch, each called with user id, user timezone and operation data from batch
+batch_operations = {
+    'get_calendars': lambda user_id, user_tz, data: calendar_app.get_calendars(user_id),
+    'get_events': lambda user_id, user_tz, data: calendar_app.get_events(
+        user_id, user_tz, data['calendar_id'], data.get('from', None), data.get('to', None), data.get('limit', None),
+        data.get('cursor', None), False, data.get('fields', None), data.get('compact', False)),
+    'get_agenda': lambda user_id, user_tz, data: calendar_app.get_agenda(
+        user_id, user_tz, data.get('from', None), data.get('to', None), data.get('limit', None),
+        data.get('cursor', None), False, data.get('fields', None), data.get('compact', False)),
+    'get_free_busy': lambda user_id, user_tz, data: calendar_app.get_free_busy(
+        user_id, user_tz, list(data['user_ids']), data['from'], data['to']),
+    'find_meeting_slots': lambda user_id, user_tz, data: calendar_app.find_meeting_slots(
+        user_id, user_tz, list(data['user_ids']), data['duration'], data['from'], data['to'],
+        data.get('work_from', None), data.get('work_to', None), data.get('limit', None)),
+    'get_changes': lambda user_id, user_tz, data: calendar_app.get_changes(
+        user_id, user_tz, data['calendar_id'], data.get('since', None), data.get('fields', None),
+        data.get('compact', False)),
+    'get_event': lambda user_id, user_tz, data: calendar_app.get_event(
+        user_id, user_tz, data['event_id'], data.get('fields', None), data.get('compact', False)),
+    'get_invites': lambda user_id, user_tz, data: calendar_app.get_invites(
+        user_id, user_tz, data.get('archive', 0), data.get('limit', None), data.get('cursor', None), False,
+        data.get('fields', None), data.get('compact', False)),
+    'get_invite': lambda user_id, user_tz, data: calendar_app.get_invite(
+        user_id, user_tz, data['invite_id'], data.get('fields', None), data.get('compact', False)),
+    'get_guests': lambda user_id, user_tz, data: calendar_app.get_guests(user_id, data['event_id']),
+    'get_guests_for_events': lambda user_id, user_tz, data: calendar_app.get_guests_for_events(
+        user_id, list(data['event_ids'])),
+    'get_shares': lambda user_id, user_tz, data: calendar_app.get_shares(user_id),
+    'add_event': lambda user_id, user_tz, data: calendar_app.add_event(
+        user_id, data['calendar_id'], data['event_name'], data['event_description'], data['start_time'],
+        data['end_time'], data.get('event_timezone', None), data['all_day_event'], data.get('recurrence', None)),
+    'edit_event': lambda user_id, user_tz, data: calendar_app.edit_event(
+        user_id, data['event_id'], data['event_name'], data['event_description'], data['start_time'],
+        data['end_time'], data.get('event_timezone', None), data['all_day_event']),
+    'delete_event': lambda user_id, user_tz, data: calendar_app.delete_event(user_id, data['event_id']),
+    'invite_users': lambda user_id, user_tz, data: calendar_app.invite_users(
+        user_id, data['event_id'], list(data['user_ids'])),
+    'edit_invite_attendance': lambda user_id, user_tz, data: calendar_app.edit_invite_attendance(
+        user_id, data['invite_id'], data['attendance']),
+}
+
+
+@app.route("/batch", methods=['POST'])
+def run_batch():
+    if session.get('user_id', None) is None:
+        ret_json = calendar_app.error_dict(1, "Need to log in before performing any action.")
+    else:
+        try:
+            in_data = request.get_json()
+
+            ret_json = calendar_app.run_batch([partial(batch_operations[operation['op']], session['user_id'],
+                                                       session['user_tz'], operation)
+                                               for operation in in_data['operations']],
+                                              in_data.get('atomic', False) is True)
+        except (KeyError, TypeError):
+            ret_json = calendar_app.error_dict(4, "Request malformed. Unknown operation or missing data.")
+        except Exception:
+            ret_json = calendar_app.error_dict(5, "Server error.")
+
+    return json_response(ret_json)
+
+
+@app.route("/notifications", methods=['GET'])
+def get_notifications():
+    if session.get('user_id', None) is None:
+        return json_response(calendar_app.error_dict(1, "Need to log in before performing any action."))
+
+    # stream does not use request context, so database connection of this request is released right away
+    return Response(iter_event_stream(calendar_app.subscribe_notifications(session['user_id']),
+                                      notifications_heartbeat), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+def create_app():
+    app.secret_key = secret_key
+
+    return app
 
 
 if __name__ == '__main__':
-    app.secret_key = 'flaskmfsimplecalendarsecretkey'
-    app.run(host='0.0.0.0', port=5000, debug=False)
+    create_app().run(host='0.0.0.0', port=5000, debug=False)
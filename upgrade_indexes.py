@@ -0,0 +1,6 @@
+# usage: python upgrade_indexes.py, once after upgrading code of existing deployment
+
+from calendar_app.calendar import calendar_app
+
+if __name__ == '__main__':
+    print(calendar_app.upgrade_indexes())
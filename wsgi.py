@@ -0,0 +1,3 @@
+from server_api import create_app
+
+app = create_app()